@@ -2,45 +2,42 @@ import serial
 from Constants import Constants
 
 class Commands:
+    #(clockwise, counter-clockwise) and (forward, backward), resolved once against reverseControls
+    _rotateCommands = ('a', 'd') if Constants.reverseControls else ('d', 'a')
+    _moveCommands = ('s', 'w') if Constants.reverseControls else ('w', 's')
+    
     def __init__(self, serialPortFile="/dev/ttyUSB0", baudRate=115200):
         self.ser = serial.Serial(serialPortFile)
         self.lastSent = "0"
+        self._outbuf = bytearray()
     
+    #Commands are buffered until flush() so a control cycle costs at most one write
     def _sendString(self,string):
         if self.lastSent != string:
-            self.ser.write(string.encode('utf-8'))
+            self._outbuf += string.encode('utf-8')
             self.lastSent = string
     
+    def flush(self):
+        if self._outbuf:
+            self.ser.write(bytes(self._outbuf))
+            self._outbuf.clear()
+    
     def rotate(self,clockwise = True):
-        if clockwise:
-            if Constants.reverseControls:
-                self._sendString('a')
-            else:
-                self._sendString('d')
-        else:
-            if Constants.reverseControls:
-                self._sendString('d')
-            else:
-                self._sendString('a')
+        self._sendString(self._rotateCommands[0 if clockwise else 1])
             
     def move(self,forward = True):
-        if forward:
-            if Constants.reverseControls:
-                self._sendString('s')
-            else:
-                self._sendString('w')
-        else:
-            if Constants.reverseControls:
-                self._sendString('w')
-            else:
-                self._sendString('s')
+        self._sendString(self._moveCommands[0 if forward else 1])
             
     def roam(self):
         self._sendString('r')
     
     def fire(self):
         self._sendString('f')
+    
+    def stop(self):
+        self._sendString('q')
         
     def __del__(self):
+        self.flush()
         self.ser.close()
         
@@ -5,14 +5,52 @@ class Constants:
     captureResolutionWidth = 640
     captureResolutionHeight = 480
     captureFPS = 30
+    #GStreamer capture pipeline, None opens cameraIndex directly. For example on a Pi:
+    #"v4l2src device=/dev/video0 ! video/x-raw,width=640,height=480,framerate=30/1 ! videoconvert ! video/x-raw,format=BGR ! appsink drop=true max-buffers=1 sync=false"
+    #On a Jetson CSI camera use "nvarguscamerasrc ! ... ! nvvidconv ! ..." in front of the appsink
+    gstreamerPipeline = None
+    #Pixel format requested from the camera, None keeps the driver default (usually YUYV).
+    #"MJPG" moves less over USB and unlocks higher resolutions and frame rates on most webcams, at the cost of a JPEG decode
+    captureFourcc = None
     cascadeMinNeighbors = 11
     cascadeScaleFactor = 1.1
+    #Either "haar", "yunet" or "auto", yunet needs yunetModelFile from the OpenCV model zoo next to main.py.
+    #auto uses yunet when that file is there and falls back to haar otherwise
+    faceDetector = "auto"
+    yunetModelFile = "face_detection_yunet_2023mar.onnx"
+    yunetScoreThreshold = 0.6
+    #Run yunet with FP16 kernels, faster on ARM boards with native half precision (Pi 5, Jetson), slower elsewhere
+    yunetUseFP16 = False
+    #Faces are detected on a frame scaled by this factor, then boxes are mapped back
+    detectionScale = 0.5
+    #Run the detector on every Nth frame, FaceTracker follows the faces in between
+    detectEveryNFrames = 3
+    #Haar detections only scan around the faces already in view, except for every Nth detection which scans the whole frame
+    fullScanEveryNDetections = 10
+    #Either "flow" (FlowTracker, sparse optical flow) or "template" (FaceTracker, template matching)
+    tracker = "flow"
+    #How far in pixels FaceTracker searches around a face's last position
+    trackerSearchMargin = 20
+    #Corners FlowTracker follows inside each face
+    flowPointsPerFace = 10
+    #Run the Haar resize and cascade through OpenCL, worth it with an iGPU but usually slower on ARM boards
+    useOpenCL = False
+    #With a CUDA device the Haar path runs this cascade on the GPU instead, the CUDA module only loads
+    #LBP cascades and the old style Haar files, like lbpcascades/lbpcascade_frontalface.xml from the OpenCV sources
+    cudaCascadeFile = "lbpcascade_frontalface.xml"
+    #The first detections also run on the CPU cascade, more than cudaCascadeMaxMismatches differing face counts falls back to it
+    cudaCascadeCheckDetections = 30
+    cudaCascadeMaxMismatches = 3
     #Either "debug" or "deployed"
     mode = "deployed"
     maxXDistanceFromCenter = 90
     minimumPixelAreaFireRange = 7800
     robotSoundEffectFile = "Ford.wav"
-    playSoundRepeatDelay = .040
     serialDevice = "/dev/ttyUSB0"
     reverseControls = True
-    enableSound = False 
+    enableSound = False
+
+    #Derived once at import, used on the per-frame path
+    maxPixelDistanceSimilaritySq = maxPixelDistanceSimilarity * maxPixelDistanceSimilarity
+    frameCenterX = captureResolutionWidth / 2
+    detectionResolution = (round(captureResolutionWidth * detectionScale), round(captureResolutionHeight * detectionScale))
@@ -0,0 +1,41 @@
+import cv2
+import numpy as np
+from Constants import Constants
+
+#Runs a cascade through cv2.cuda with the same detectMultiScale call as cv2.CascadeClassifier.
+#The CUDA cascade quantizes window sizes, so the first detections also run on the CPU cascade
+#and if the face counts disagree too often every later detection stays on the CPU.
+class CudaCascade:
+    def __init__(self, cpuCascade):
+        self.cpuCascade = cpuCascade
+        self.gpuCascade = cv2.cuda.CascadeClassifier.create(Constants.cudaCascadeFile)
+        self.gpuGray = cv2.cuda.GpuMat()
+        self.useGpu = True
+        self.checksLeft = Constants.cudaCascadeCheckDetections
+        self.mismatches = 0
+
+    @staticmethod
+    def isAvailable():
+        return hasattr(cv2, "cuda") and cv2.cuda.getCudaEnabledDeviceCount() > 0
+
+    def _detectOnGpu(self, gray, scaleFactor, minNeighbors):
+        self.gpuCascade.setScaleFactor(scaleFactor)
+        self.gpuCascade.setMinNeighbors(minNeighbors)
+        #Only the gray frame crosses to the device, into the same GpuMat every time
+        self.gpuGray.upload(np.ascontiguousarray(gray))
+        faces = self.gpuCascade.convert(self.gpuCascade.detectMultiScale(self.gpuGray))
+        return () if faces is None else faces
+
+    def detectMultiScale(self, gray, scaleFactor, minNeighbors):
+        if not self.useGpu:
+            return self.cpuCascade.detectMultiScale(gray, scaleFactor=scaleFactor, minNeighbors=minNeighbors)
+
+        faces = self._detectOnGpu(gray, scaleFactor, minNeighbors)
+        if self.checksLeft > 0:
+            self.checksLeft -= 1
+            if len(faces) != len(self.cpuCascade.detectMultiScale(gray, scaleFactor=scaleFactor, minNeighbors=minNeighbors)):
+                self.mismatches += 1
+            if self.mismatches > Constants.cudaCascadeMaxMismatches:
+                print("CUDA cascade disagrees with the CPU cascade, detecting on the CPU")
+                self.useGpu = False
+        return faces
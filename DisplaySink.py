@@ -0,0 +1,39 @@
+import cv2
+import threading
+
+#Shows frames from its own thread so imshow/waitKey never hold up the control loop.
+#Only the newest pushed frame is kept, older ones that were never shown are dropped.
+class DisplaySink:
+    def displayLoop(self):
+        while not self.exitEvent.is_set():
+            if self.frameEvent.wait(timeout=0.1):
+                with self.lock:
+                    frame = self.latest
+                    self.latest = None
+                    self.frameEvent.clear()
+                
+                if frame is not None:
+                    cv2.imshow(self.windowName, frame)
+            #Keeps the window responsive even while no new frames arrive
+            cv2.waitKey(1)
+        
+        cv2.destroyAllWindows()
+
+    def __init__(self, windowName='Sentinel Dart X'):
+        self.windowName = windowName
+        self.latest = None
+        self.lock = threading.Lock()
+        self.frameEvent = threading.Event()
+        self.exitEvent = threading.Event()
+        self.thread = threading.Thread(target=self.displayLoop, daemon=True)
+        self.thread.start()
+
+    def push(self, frame):
+        with self.lock:
+            self.latest = frame
+            self.frameEvent.set()
+
+    def stop(self):
+        self.exitEvent.set()
+        self.frameEvent.set()
+        self.thread.join()
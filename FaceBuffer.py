@@ -1,83 +1,162 @@
-import math
+import numpy as np
 from Constants import Constants
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+#Index of the face each detection row matches, or -1 for a new face.
+#Detections are matched in order, each to the closest face within maxDistanceSq no earlier detection took.
+def _matchFacesVectorized(xs, ys, frames, rawFaces, maxDistanceSq):
+    matches = np.full(len(rawFaces), -1, dtype=np.int64)
+    if len(xs) == 0:
+        return matches
+    
+    #Squared distances from every detection to every face in one go, out of range or already matched faces are masked out
+    dx = rawFaces[:, 0, None] - xs[None, :].astype(np.int64)
+    dy = rawFaces[:, 1, None] - ys[None, :].astype(np.int64)
+    distanceSq = dx*dx + dy*dy
+    distanceSq[(distanceSq > maxDistanceSq) | (frames == 0)[None, :]] = np.iinfo(np.int64).max
+    
+    for d in range(len(rawFaces)):
+        i = distanceSq[d].argmin()
+        if distanceSq[d, i] != np.iinfo(np.int64).max:
+            matches[d] = i
+            distanceSq[:, i] = np.iinfo(np.int64).max
+    return matches
+
+def _matchFacesLoop(xs, ys, frames, rawFaces, maxDistanceSq):
+    matches = np.full(len(rawFaces), -1, dtype=np.int64)
+    taken = frames == 0
+    
+    for d in range(len(rawFaces)):
+        closest = -1
+        closestDistanceSq = maxDistanceSq + 1
+        for i in range(len(xs)):
+            if taken[i]:
+                continue
+            
+            dx = xs[i] - rawFaces[d, 0]
+            dy = ys[i] - rawFaces[d, 1]
+            distanceSq = dx*dx + dy*dy
+            if distanceSq < closestDistanceSq:
+                closest = i
+                closestDistanceSq = distanceSq
+        
+        if closest >= 0:
+            matches[d] = closest
+            taken[closest] = True
+    return matches
+
+if njit is not None:
+    #An explicit signature compiles eagerly at import instead of stalling the first frame
+    matchFaces = njit("i8[::1](i4[::1], i4[::1], i4[::1], i4[:, ::1], i8)", cache=True, fastmath=True, boundscheck=False)(_matchFacesLoop)
+else:
+    matchFaces = _matchFacesVectorized
+
 class Face:
-    def __init__(self, faceId, x, y, w, h): 
+    __slots__ = ("faceId", "x", "y", "w", "h", "framesSinceLastSeen")
+
+    def __init__(self, faceId, x, y, w, h):
         self.faceId = faceId
-        self.x, self.y, self.w, self.h = x,y,h,w
+        self.x, self.y, self.w, self.h = x,y,w,h
         self.framesSinceLastSeen = 0
 
-class RawFace:
-    def __init__(self, x, y, w, h):
-        self.x, self.y, self.w, self.h = x,y,w,h       
-
 class FaceBuffer:
-    def __init__(self):
+    #Tracked faces are kept as parallel arrays, only the first faceCount entries are live
+    def __init__(self, capacity=8):
         self.nextFaceId = 0
-        self.faceList = []
-    
-    def isNotOldFace(self, face):
-        if face.framesSinceLastSeen >= Constants.deleteAtGoneFrame:
-            return False
-        return True    
+        self.faceCount = 0
+
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._x = np.zeros(capacity, dtype=np.int32)
+        self._y = np.zeros(capacity, dtype=np.int32)
+        self._w = np.zeros(capacity, dtype=np.int32)
+        self._h = np.zeros(capacity, dtype=np.int32)
+        self._frames = np.zeros(capacity, dtype=np.int32)
+
+    def _columnNames(self):
+        return ("_ids", "_x", "_y", "_w", "_h", "_frames")
+
+    def _reserve(self, count):
+        capacity = len(self._ids)
+        if count <= capacity:
+            return
+
+        while capacity < count:
+            capacity *= 2
+
+        for name in self._columnNames():
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.faceCount] = column[:self.faceCount]
+            setattr(self, name, grown)
+
+    def _faceAt(self, i):
+        face = Face(int(self._ids[i]), int(self._x[i]), int(self._y[i]), int(self._w[i]), int(self._h[i]))
+        face.framesSinceLastSeen = int(self._frames[i])
+        return face
 
     def incrementSinceLastSeen(self):
-        faceCount = len(self.faceList)
-        
-        for i in range(faceCount):
-            self.faceList[i].framesSinceLastSeen += 1
+        self._frames[:self.faceCount] += 1
 
-    def processIfFaceExists(self, rawFace):
-        faceCount = len(self.faceList)
+    def _updateFace(self, i, x, y, w, h):
+        self._frames[i] = 0
+        self._x[i] = x
+        self._y[i] = y
+        self._w[i] = w
+        self._h[i] = h
 
-        for i in range(faceCount):
-            currentFace = self.faceList[i]
-            if currentFace.framesSinceLastSeen == 0:
-                continue
-            
-            if math.dist([currentFace.x, currentFace.y], [rawFace.x, rawFace.y]) <= Constants.maxPixelDistanceSimilarity:
-                self.faceList[i].framesSinceLastSeen = 0
-                self.faceList[i].x = rawFace.x
-                self.faceList[i].y = rawFace.y
-                self.faceList[i].w = rawFace.w
-                self.faceList[i].h = rawFace.h
-                
-                return True
-                
-
-        return False
-
-    def addNewFace(self, rawFace):
-        self.faceList.append(Face(self.nextFaceId, rawFace.x, rawFace.y, rawFace.w, rawFace.h))
+    def _appendFace(self, x, y, w, h):
+        self._reserve(self.faceCount + 1)
+
+        i = self.faceCount
+        self._ids[i] = self.nextFaceId
+        self._x[i], self._y[i], self._w[i], self._h[i] = x, y, w, h
+        self._frames[i] = 0
+        self.faceCount += 1
         self.nextFaceId += 1
 
     def cullOldFaces(self):
-        self.faceList = list(filter(self.isNotOldFace, self.faceList))
+        n = self.faceCount
+        keep = self._frames[:n] < Constants.deleteAtGoneFrame
+        kept = int(np.count_nonzero(keep))
+        #Most frames nothing has aged out, leave the arrays untouched
+        if kept == n:
+            return
+
+        for name in self._columnNames():
+            column = getattr(self, name)
+            column[:kept] = column[:n][keep]
+        self.faceCount = kept
 
     #Only use this
-    def processNewFrame(self, rawFaceList):
+    #rawFaces is an (N, 4) array of x, y, w, h rows as returned by detectMultiScale
+    def processNewFrame(self, rawFaces):
         self.incrementSinceLastSeen()
-        
-        for rawFace in rawFaceList:
-            if not self.processIfFaceExists(rawFace):
-                self.addNewFace(rawFace)
-    
+
+        #All detections are matched against the existing faces in one call, faces added this frame are never candidates
+        rawFaces = np.ascontiguousarray(rawFaces, dtype=np.int32).reshape(-1, 4)
+        n = self.faceCount
+        matches = matchFaces(self._x[:n], self._y[:n], self._frames[:n], rawFaces, Constants.maxPixelDistanceSimilaritySq)
+
+        for (x, y, w, h), i in zip(rawFaces.tolist(), matches.tolist()):
+            if i < 0:
+                self._appendFace(x, y, w, h)
+            else:
+                self._updateFace(i, x, y, w, h)
+
         self.cullOldFaces()
 
     #or this
     def getFaces(self):
-        return self.faceList
-    
-    #or this 
+        return [self._faceAt(i) for i in range(self.faceCount)]
+
+    #or this
     def getOldestTrackedFace(self):
-        if len(self.faceList) == 0:
+        #Ids are handed out in increasing order and culling keeps order, so the oldest face is always first
+        if self.faceCount == 0:
             return None
-        
-        lowestIdIndex = 0
-        
-        for i, face in enumerate(self.faceList):
-            if face.faceId < self.faceList[lowestIdIndex].faceId:
-                lowestIdIndex = i
-        
-        return self.faceList[lowestIdIndex]
-                
+
+        return self._faceAt(0)
@@ -0,0 +1,39 @@
+import cv2
+import numpy as np
+from Constants import Constants
+
+#Follows detected faces between detections by matching each face's patch in a window around its last box
+class FaceTracker:
+    def __init__(self):
+        self.boxes = []
+        self.sizes = []
+        self.templates = []
+
+    #rawFaces is an (N, 4) array of x, y, w, h rows
+    #A box scaled up from the detection frame can run past the frame edge, the template is clipped to the frame
+    #but the detected size is what gets reported, it's what the fire decision measures
+    def reset(self, gray, rawFaces):
+        rows = rawFaces.tolist()
+        self.templates = [gray[y:y + h, x:x + w].copy() for x, y, w, h in rows]
+        self.boxes = [(x, y) for x, y, w, h in rows]
+        self.sizes = [(w, h) for x, y, w, h in rows]
+
+    def update(self, gray):
+        height, width = gray.shape
+        margin = Constants.trackerSearchMargin
+        rawFaces = np.empty((len(self.templates), 4), dtype=np.int32)
+
+        for i, template in enumerate(self.templates):
+            x, y = self.boxes[i]
+            th, tw = template.shape
+            left, top = max(0, x - margin), max(0, y - margin)
+            window = gray[top:min(height, y + th + margin), left:min(width, x + tw + margin)]
+
+            if window.shape[0] >= th and window.shape[1] >= tw and th > 0 and tw > 0:
+                _, _, _, (dx, dy) = cv2.minMaxLoc(cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED))
+                x, y = left + dx, top + dy
+                self.boxes[i] = (x, y)
+
+            rawFaces[i] = (x, y, *self.sizes[i])
+
+        return rawFaces
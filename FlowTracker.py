@@ -0,0 +1,58 @@
+import cv2
+import numpy as np
+from Constants import Constants
+
+#Follows detected faces between detections with sparse optical flow on a few corners inside each face.
+#Same interface as FaceTracker, each box moves by the median motion of its surviving points.
+class FlowTracker:
+    def __init__(self):
+        self.boxes = np.empty((0, 4), dtype=np.int32)
+        self.points = np.empty((0, 1, 2), dtype=np.float32)
+        self.owners = np.empty(0, dtype=np.intp)
+        self.previousGray = None
+
+    def _rememberFrame(self, gray):
+        #The caller reuses its gray buffer every frame, so keep a copy in a buffer of our own
+        if self.previousGray is None or self.previousGray.shape != gray.shape:
+            self.previousGray = np.empty_like(gray)
+        np.copyto(self.previousGray, gray)
+
+    #rawFaces is an (N, 4) array of x, y, w, h rows
+    def reset(self, gray, rawFaces):
+        self.boxes = rawFaces.astype(np.int32)
+        points = []
+        owners = []
+        for i, (x, y, w, h) in enumerate(self.boxes.tolist()):
+            corners = cv2.goodFeaturesToTrack(gray[y:y + h, x:x + w], Constants.flowPointsPerFace, 0.01, 3) if w > 0 and h > 0 else None
+            if corners is None:
+                #Nothing textured enough in the box, follow its center instead
+                corners = np.array([[[w * 0.5, h * 0.5]]], dtype=np.float32)
+            points.append(corners + np.array([x, y], dtype=np.float32))
+            owners.append(np.full(len(corners), i, dtype=np.intp))
+
+        if points:
+            self.points = np.concatenate(points).astype(np.float32)
+            self.owners = np.concatenate(owners)
+        else:
+            self.points = np.empty((0, 1, 2), dtype=np.float32)
+            self.owners = np.empty(0, dtype=np.intp)
+        self._rememberFrame(gray)
+
+    def update(self, gray):
+        if len(self.points) != 0:
+            nextPoints, status, _ = cv2.calcOpticalFlowPyrLK(self.previousGray, gray, self.points, None, winSize=(15, 15), maxLevel=2)
+            found = status[:, 0] == 1
+            motion = (nextPoints - self.points)[found, 0]
+            owners = self.owners[found]
+
+            for i in np.unique(owners).tolist():
+                dx, dy = np.median(motion[owners == i], axis=0)
+                self.boxes[i, 0] += int(round(dx))
+                self.boxes[i, 1] += int(round(dy))
+
+            #Points the flow lost stay lost until the next detection reseeds them
+            self.points = nextPoints[found]
+            self.owners = owners
+
+        self._rememberFrame(gray)
+        return self.boxes.copy()
@@ -1,8 +1,17 @@
 import cv2
+import gc
+import os
+import queue
+import threading
+import numpy as np
 from Constants import Constants
-from FaceBuffer import FaceBuffer, RawFace, Face
+from FaceBuffer import FaceBuffer, Face
+from FaceTracker import FaceTracker
+from CudaCascade import CudaCascade
+from FlowTracker import FlowTracker
 from Commands import Commands
 from Sound import Sound
+from DisplaySink import DisplaySink
 
 def debug():
     return Constants.mode == "debug"
@@ -11,43 +20,216 @@ def deployed():
     return Constants.mode == "deployed"
 
 def setupCaptureDevice():
+    if Constants.gstreamerPipeline is not None:
+        #The appsink only ever holds the newest frame, and on Jetson frames stay in NVMM until the final convert
+        cap = cv2.VideoCapture(Constants.gstreamerPipeline, cv2.CAP_GSTREAMER)
+        if cap.isOpened():
+            return cap
+        print("GStreamer pipeline unavailable, falling back to camera index")
+    
     cap = cv2.VideoCapture(Constants.cameraIndex)
     if not cap.isOpened():
         print("Error: Could not open webcam.")
         exit()
     
+    #The format has to be chosen before the resolution, some drivers only offer larger sizes in MJPG
+    if Constants.captureFourcc is not None:
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*Constants.captureFourcc))
     cap.set(cv2.CAP_PROP_FRAME_WIDTH, Constants.captureResolutionWidth)
     cap.set(cv2.CAP_PROP_FRAME_HEIGHT, Constants.captureResolutionHeight)
     cap.set(cv2.CAP_PROP_FPS, Constants.captureFPS)
+    #Keep at most one queued frame so the loop never works on stale ones
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
     return cap
 
 def drawTrackedFaces(faces, resizedFrame):
+    if len(faces) == 0:
+        return
+    
+    #All boxes in a single polylines call
+    boxes = np.array([[(face.x, face.y), (face.x + face.w, face.y), (face.x + face.w, face.y + face.h), (face.x, face.y + face.h)] for face in faces], dtype=np.int32)
+    cv2.polylines(resizedFrame, boxes, True, (0,255,0), 3)
+    
+    #The per-face text changes every frame, so only what's shared between faces is looked up once.
+    #Small debug text is drawn without antialiasing, the cached action label keeps it
+    centerX = Constants.frameCenterX
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    color = (255, 0, 0)
     for face in faces:
-        cv2.rectangle(resizedFrame, (face.x, face.y), (face.x + face.w, face.y + face.h), (0,255,0), 3)
-        cv2.putText(resizedFrame, str(face.faceId), (face.x, face.y), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 0, 0), 2, cv2.LINE_AA)
-        cv2.putText(resizedFrame, f'Pixel Area: {face.w * face.h}', (face.x, face.y + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 0, 0), 2, cv2.LINE_AA)
-        cv2.putText(resizedFrame, f'Distance From Center: {(face.x + (face.w / 2)) - (Constants.captureResolutionWidth/2)}', (face.x, face.y + 40), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 0, 0), 2, cv2.LINE_AA)
+        x, y = face.x, face.y
+        cv2.putText(resizedFrame, str(face.faceId), (x, y), font, 1.0, color, 2, cv2.LINE_8)
+        cv2.putText(resizedFrame, f'Pixel Area: {face.w * face.h}', (x, y + 20), font, 0.7, color, 2, cv2.LINE_8)
+        cv2.putText(resizedFrame, f'Distance From Center: {(x + (face.w / 2)) - centerX}', (x, y + 40), font, 0.7, color, 2, cv2.LINE_8)
+
+#Action labels drawn on the debug frame, rasterized once per text and then only copied in
+labelCache = {}
+
+def drawLabel(frame, text):
+    label = labelCache.get(text)
+    if label is None:
+        (width, height), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 3.0, 2)
+        patch = np.zeros((height + baseline, width, 3), dtype=np.uint8)
+        cv2.putText(patch, text, (0, height), cv2.FONT_HERSHEY_SIMPLEX, 3.0, (0, 0, 255), 2, cv2.LINE_AA)
+        label = (patch, patch[:, :, 2:] != 0, height)
+        labelCache[text] = label
+    
+    #Same placement as putText at (0,80), clipped to the frame
+    patch, mask, height = label
+    top = 80 - height
+    skip = max(0, -top)
+    region = frame[top + skip:top + patch.shape[0], :patch.shape[1]]
+    rows, cols = region.shape[:2]
+    np.copyto(region, patch[skip:skip + rows, :cols], where=mask[skip:skip + rows, :cols])
+
+#Stage 1: keeps grabbing frames, None tells the next stage the camera is gone.
+#If the stage itself fails the exception is sent on instead so loop() can raise it.
+def captureLoop(cap, frameQueue):
+    try:
+        while True:
+            ret = cap.grab()
+            if ret:
+                ret, frame = cap.retrieve()
+            
+            if not ret:
+                print("Failed to grab frame")
+                frameQueue.put(None)
+                return
+            
+            #Never wait on a busy detector, the oldest frame is dropped so it always gets the latest one
+            try:
+                frameQueue.put_nowait(frame)
+            except queue.Full:
+                try:
+                    frameQueue.get_nowait()
+                except queue.Empty:
+                    pass
+                frameQueue.put_nowait(frame)
+    except Exception as e:
+        frameQueue.put(e)
+
+def createFaceDetector():
+    if Constants.faceDetector == "yunet" or (Constants.faceDetector == "auto" and os.path.exists(Constants.yunetModelFile)):
+        target = cv2.dnn.DNN_TARGET_CPU_FP16 if Constants.yunetUseFP16 else cv2.dnn.DNN_TARGET_CPU
+        return cv2.FaceDetectorYN.create(Constants.yunetModelFile, "", Constants.detectionResolution, score_threshold=Constants.yunetScoreThreshold, backend_id=cv2.dnn.DNN_BACKEND_OPENCV, target_id=target)
+    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    if not Constants.useOpenCL and os.path.exists(Constants.cudaCascadeFile) and CudaCascade.isAvailable():
+        return CudaCascade(cascade)
+    return cascade
 
-def displayFrame(frame):
-    cv2.imshow('Sentinel Dart X', frame)
-    cv2.waitKey(1)
+#Bounding box around the faces grown by each face's own size on every side, in detection frame coordinates
+def regionAroundFaces(rawFaces):
+    if len(rawFaces) == 0:
+        return None
+    
+    scale = Constants.detectionScale
+    width, height = Constants.detectionResolution
+    x, y, w, h = rawFaces.T
+    left = max(0, int((x - w).min() * scale))
+    top = max(0, int((y - h).min() * scale))
+    right = min(width, int((x + 2 * w).max() * scale))
+    bottom = min(height, int((y + 2 * h).max() * scale))
+    if right <= left or bottom <= top:
+        return None
+    return (left, top, right, bottom)
+
+#region limits the Haar scan to part of the frame, the other detectors always scan the whole frame
+def detectFaces(faceDetector, resizedFrame, gray, detectionBuffer, region=None):
+    if isinstance(faceDetector, cv2.FaceDetectorYN):
+        detectionFrame = cv2.resize(resizedFrame, Constants.detectionResolution, dst=detectionBuffer, interpolation=cv2.INTER_AREA)
+        _, detections = faceDetector.detect(detectionFrame)
+        faces = [] if detections is None else detections[:, :4]
+    elif Constants.useOpenCL:
+        #Upload once, the resize and the cascade both have OpenCL kernels
+        detectionGray = cv2.resize(cv2.UMat(gray), Constants.detectionResolution, interpolation=cv2.INTER_AREA)
+        faces = faceDetector.detectMultiScale(detectionGray, scaleFactor=Constants.cascadeScaleFactor, minNeighbors=Constants.cascadeMinNeighbors)
+    else:
+        detectionGray = cv2.resize(gray, Constants.detectionResolution, dst=detectionBuffer, interpolation=cv2.INTER_AREA)
+        if region is None:
+            faces = faceDetector.detectMultiScale(detectionGray, scaleFactor=Constants.cascadeScaleFactor, minNeighbors=Constants.cascadeMinNeighbors)
+        else:
+            left, top, right, bottom = region
+            faces = faceDetector.detectMultiScale(detectionGray[top:bottom, left:right], scaleFactor=Constants.cascadeScaleFactor, minNeighbors=Constants.cascadeMinNeighbors)
+            if len(faces) != 0:
+                faces = faces + (left, top, 0, 0)
+    if len(faces) == 0:
+        return np.empty((0, 4), dtype=np.int32)
+    
+    #Kept as one (N, 4) array of x, y, w, h rows all the way into FaceBuffer
+    return (np.asarray(faces) / Constants.detectionScale).astype(np.int32)
+
+#Stage 2: resizes and runs detection, faces are followed by the tracker on frames where detection is skipped
+def detectLoop(faceDetector, frameQueue, resultQueue):
+    tracker = FlowTracker() if Constants.tracker == "flow" else FaceTracker()
+    frameIndex = 0
+    detectionIndex = 0
+    rawFaces = np.empty((0, 4), dtype=np.int32)
+    #Gray and detection frames never leave this thread, so one buffer each is reused for every frame
+    grayBuffer = np.empty((Constants.captureResolutionHeight, Constants.captureResolutionWidth), dtype=np.uint8)
+    #yunet detects on color, the cascade on gray
+    if isinstance(faceDetector, cv2.FaceDetectorYN):
+        detectionBuffer = np.empty((Constants.detectionResolution[1], Constants.detectionResolution[0], 3), dtype=np.uint8)
+    else:
+        detectionBuffer = np.empty((Constants.detectionResolution[1], Constants.detectionResolution[0]), dtype=np.uint8)
+    try:
+        while True:
+            frame = frameQueue.get()
+            #None and a failure from capture both end this stage too
+            if frame is None or isinstance(frame, Exception):
+                resultQueue.put(frame)
+                return
+            
+            #The camera usually delivers the requested resolution already, work on its buffer directly then
+            if frame.shape[1] == Constants.captureResolutionWidth and frame.shape[0] == Constants.captureResolutionHeight:
+                resizedFrame = frame
+            else:
+                resizedFrame = cv2.resize(frame,(Constants.captureResolutionWidth,Constants.captureResolutionHeight))
+            
+            gray = cv2.cvtColor(resizedFrame, cv2.COLOR_BGR2GRAY, dst=grayBuffer)
+            if frameIndex % Constants.detectEveryNFrames == 0:
+                #While faces are in view only scan around them, a periodic full scan picks up new ones.
+                #Losing them all leaves rawFaces empty, which makes the next detection a full scan too.
+                region = None if detectionIndex % Constants.fullScanEveryNDetections == 0 else regionAroundFaces(rawFaces)
+                rawFaces = detectFaces(faceDetector, resizedFrame, gray, detectionBuffer, region)
+                detectionIndex += 1
+                tracker.reset(gray, rawFaces)
+            else:
+                rawFaces = tracker.update(gray)
+            frameIndex += 1
+            
+            resultQueue.put((resizedFrame, rawFaces))
+    except Exception as e:
+        resultQueue.put(e)
 
-def loop(faceCascade, cap, fb, s, cs):
+#Stage 3 runs here: tracking and targeting stay on the calling thread, debug frames go to DisplaySink
+def loop(faceDetector, cap, fb, s, cs, sink):
+    #Capture keeps only the newest frame, the small result queue gives back-pressure so no stage runs ahead
+    frameQueue = queue.Queue(maxsize=1)
+    resultQueue = queue.Queue(maxsize=2)
+    threading.Thread(target=captureLoop, args=(cap, frameQueue), daemon=True).start()
+    threading.Thread(target=detectLoop, args=(faceDetector, frameQueue, resultQueue), daemon=True).start()
+    
+    #Mode and thresholds don't change mid-run, bind them once instead of looking them up every frame
+    isDebug = debug()
+    isDeployed = deployed()
+    centerX = Constants.frameCenterX
+    maxDx = Constants.maxXDistanceFromCenter
+    minArea = Constants.minimumPixelAreaFireRange
+    
     while True:
-        ret, frame = cap.read()
-        
-        if not ret:
-            print("Failed to grab frame")
+        result = resultQueue.get()
+        if result is None:
             break
+        if isinstance(result, Exception):
+            #Don't leave the robot driving or firing on its last command, then fail so the service restarts
+            if isDeployed:
+                cs.stop()
+                cs.flush()
+            raise result
         
-        resizedFrame = cv2.resize(frame,(Constants.captureResolutionWidth,Constants.captureResolutionHeight))
-        gray = cv2.cvtColor(resizedFrame, cv2.COLOR_BGR2GRAY)
-        faces = faceCascade.detectMultiScale(gray, scaleFactor=Constants.cascadeScaleFactor, minNeighbors=Constants.cascadeMinNeighbors)
-        
-        rawFaces = [RawFace(face[0], face[1], face[2], face[3]) for face in faces]
+        resizedFrame, rawFaces = result
         fb.processNewFrame(rawFaces)
         
-        if debug():
+        if isDebug:
             trackedFaces = fb.getFaces()
             drawTrackedFaces(trackedFaces, resizedFrame)
         
@@ -55,51 +237,49 @@ def loop(faceCascade, cap, fb, s, cs):
         
         
         if oldestFace is not None:
-            def deltaFromCenter(face):
-                centerX = Constants.captureResolutionWidth / 2
-                return face.x + (face.w / 2) - centerX
-
-            def pixelArea(face):
-                return face.w * face.h
+            dx = oldestFace.x + oldestFace.w * 0.5 - centerX
 
-
-            if abs(deltaFromCenter(oldestFace)) < Constants.maxXDistanceFromCenter:
-                if pixelArea(oldestFace) >= Constants.minimumPixelAreaFireRange:
-                    if deployed():
+            if abs(dx) < maxDx:
+                if oldestFace.w * oldestFace.h >= minArea:
+                    if isDeployed:
                         cs.fire()
-                    if debug():
-                        cv2.putText(resizedFrame, "FIRE", (0,80), cv2.FONT_HERSHEY_SIMPLEX, 3.0, (0, 0, 255), 2, cv2.LINE_AA)
+                    if isDebug:
+                        drawLabel(resizedFrame, "FIRE")
                     if s != None:
                         s.play()
                 else:
-                    if deployed():
+                    if isDeployed:
                         cs.move(forward=True)
-                    if debug():
-                        cv2.putText(resizedFrame, "FORWARD", (0,80), cv2.FONT_HERSHEY_SIMPLEX, 3.0, (0, 0, 255), 2, cv2.LINE_AA)
+                    if isDebug:
+                        drawLabel(resizedFrame, "FORWARD")
             else:
-                if deltaFromCenter(oldestFace) < 0:
-                    if deployed():
+                if dx < 0:
+                    if isDeployed:
                         cs.rotate(clockwise=False)
-                    if debug():
-                        cv2.putText(resizedFrame, "ROTATE LEFT", (0,80), cv2.FONT_HERSHEY_SIMPLEX, 3.0, (0, 0, 255), 2, cv2.LINE_AA)
+                    if isDebug:
+                        drawLabel(resizedFrame, "ROTATE LEFT")
                 else:
-                    if deployed():
+                    if isDeployed:
                         cs.rotate(clockwise=True)
-                    if debug():
-                        cv2.putText(resizedFrame, "ROTATE RIGHT", (0,80), cv2.FONT_HERSHEY_SIMPLEX, 3.0, (0, 0, 255), 2, cv2.LINE_AA)
+                    if isDebug:
+                        drawLabel(resizedFrame, "ROTATE RIGHT")
         else:
-            if deployed():
+            if isDeployed:
                 cs.roam()
-            if debug():
-                cv2.putText(resizedFrame, "ROAM", (0,80), cv2.FONT_HERSHEY_SIMPLEX, 3.0, (0, 0, 255), 2, cv2.LINE_AA)
+            if isDebug:
+                drawLabel(resizedFrame, "ROAM")
         
-        if debug():
-            displayFrame(resizedFrame)
+        if isDeployed:
+            cs.flush()
+        
+        if isDebug:
+            sink.push(resizedFrame)
 
     
 
 def main():
-    faceCascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    cv2.ocl.setUseOpenCL(Constants.useOpenCL)
+    faceDetector = createFaceDetector()
     cap = setupCaptureDevice()
     fb = FaceBuffer()
     if Constants.enableSound:
@@ -108,12 +288,22 @@ def main():
         cs = Commands(Constants.serialDevice)
     else:
         cs = None
-    if Constants.enableSound: 
-        loop(faceCascade, cap, fb, s, cs)
-    else:
-        loop(faceCascade, cap, fb, None, cs)
-    cap.release()
     if debug():
-        cv2.destroyAllWindows()
+        sink = DisplaySink()
+    else:
+        sink = None
+    #Everything allocated during startup lives until exit, move it out of the collector's reach so
+    #occasional full collections during the loop don't have to walk the imported libraries
+    gc.collect()
+    gc.freeze()
+    try:
+        if Constants.enableSound: 
+            loop(faceDetector, cap, fb, s, cs, sink)
+        else:
+            loop(faceDetector, cap, fb, None, cs, sink)
+    finally:
+        cap.release()
+        if debug():
+            sink.stop()
 
 main()
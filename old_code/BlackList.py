@@ -1,27 +1,290 @@
+import os
+import json
+import queue
+import pickle
+import threading
+import cv2
+import numpy as np
 from deepface import DeepFace
+from deepface.commons import folder_utils
 from Faces import Faces
 from FaceDetector import FaceDetector
 
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+try:
+    import onnxruntime as ort
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+except ImportError:
+    ort = None
+
 class BlackList:
+        _modelName = "SFace"
+        _modelInputSize = (112, 112)
+        _modelWeightsFile = "face_recognition_sface_2021dec.onnx"
+        _quantizedWeightsFile = "face_recognition_sface_2021dec_uint8.onnx"
+        # DeepFace's cosine distance threshold for SFace is 0.593
+        _similarityThreshold = 1 - 0.593
+        # Representation cache written by DeepFace.find for the default opencv detector
+        _representationsFile = "ds_model_sface_detector_opencv_aligned_normalization_base_expand_0.pkl"
+        # Normalized embeddings transcoded from the cache above, memory mapped so processes share the pages.
+        # With the quantized model the database is embedded again by that model and kept in its own file
+        _embeddingsFile = "db_emb.npy"
+        _quantizedEmbeddingsFile = "db_emb_uint8.npy"
+        _identitiesFile = "db_ids.json"
+        # A face within this many pixels of a face seen last frame is treated as the same face
+        _maxReuseDistance = 20
+        # Re-embed a face after reusing its verdict for this many frames. Every consecutive non-match doubles
+        # that for the face, up to _maxBackoffAge, since most faces in view will never match
+        _maxVerdictAge = 30
+        _maxBackoffAge = 240
+        # Faces narrower than this are too far away to identify reliably, they are never embedded
+        _minFaceWidth = 40
+
         def __init__(self, databaseFolder):
             self._fd = FaceDetector()
             self._fd.start_camera()
             self._databaseFolder = databaseFolder
+            self._session = None
+            if cv2.cuda.getCudaEnabledDeviceCount() > 0:
+                self._useGpu()
+            elif ort is not None:
+                self._session = self._loadQuantizedModel()
+            self._dbEmbeddings = self._loadDatabaseEmbeddings()
+            self._index = self._buildIndex()
+            self._clearVerdictCache()
+            # Embedding runs on a worker so camera frames keep flowing while it's busy, verdicts come back a
+            # frame or two later and join the verdict cache. One batch is in flight at a time.
+            self._requests = queue.Queue(maxsize=1)
+            self._results = queue.Queue()
+            self._inFlight = False
+            self._worker = threading.Thread(target=self._recognitionLoop, daemon=True)
+            self._worker.start()
+
+        def _weightsPath(self, file):
+            return os.path.join(folder_utils.get_deepface_home(), ".deepface", "weights", file)
+
+        def _useGpu(self):
+            # DeepFace runs SFace through OpenCV's FaceRecognizerSF, rebuild its cached instance on the CUDA DNN backend
+            sface = DeepFace.build_model(self._modelName).model
+            sface.model = cv2.FaceRecognizerSF.create(model=self._weightsPath(self._modelWeightsFile), config="", backend_id=cv2.dnn.DNN_BACKEND_CUDA, target_id=cv2.dnn.DNN_TARGET_CUDA)
+
+        def _loadQuantizedModel(self):
+            # On CPU run an 8 bit copy of the SFace weights through ONNX Runtime, quantized once and kept next to the original.
+            # Without ONNX Runtime, or if the session can't be built, DeepFace runs the float model instead
+            quantizedPath = self._weightsPath(self._quantizedWeightsFile)
+            if not os.path.exists(quantizedPath):
+                DeepFace.build_model(self._modelName)
+                self._quantizeWeights(self._weightsPath(self._modelWeightsFile), quantizedPath)
+
+            try:
+                return self._createSession(quantizedPath)
+            except Exception as e:
+                print(f"Quantized SFace model failed to load, using DeepFace instead: {e}")
+                return None
+
+        @staticmethod
+        def _quantizeWeights(weightsPath, quantizedPath):
+            # SFace is mostly convolutions, which quantize to ConvInteger. Older ONNX Runtime CPU builds only
+            # implement that for uint8 weights, so uint8 it is
+            quantize_dynamic(weightsPath, quantizedPath, weight_type=QuantType.QUInt8)
+
+        @staticmethod
+        def _createSession(modelPath):
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = os.cpu_count()
+            return ort.InferenceSession(modelPath, options, providers=["CPUExecutionProvider"])
+
+        @staticmethod
+        def _runSession(session, inputs):
+            # The model zoo's SFace graph has a fixed batch of 1, run it in slices of whatever batch the graph takes
+            modelInput = session.get_inputs()[0]
+            batchSize = modelInput.shape[0] if isinstance(modelInput.shape[0], int) else max(1, len(inputs))
+            outputs = [session.run(None, {modelInput.name: inputs[i:i + batchSize]})[0] for i in range(0, len(inputs), batchSize)]
+            return np.concatenate(outputs)
+
+        def _normalize(self, embeddings):
+            # Contiguous float32 rows so the similarity matmul goes straight to BLAS SGEMM
+            embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+            return embeddings
+
+        def _loadDatabaseEmbeddings(self):
+            # Let DeepFace build (or refresh) its representation cache for the database once,
+            # then keep the embeddings resident instead of re-reading the folder every frame
+            DeepFace.find(img_path=np.zeros((*self._modelInputSize, 3), dtype=np.uint8), db_path=self._databaseFolder, model_name=self._modelName, silent=True, enforce_detection=False)
+
+            representationsPath = os.path.join(self._databaseFolder, self._representationsFile)
+            embeddingsPath = os.path.join(self._databaseFolder, self._embeddingsFile if self._session is None else self._quantizedEmbeddingsFile)
+            identitiesPath = os.path.join(self._databaseFolder, self._identitiesFile)
+
+            if not os.path.exists(embeddingsPath) or os.path.getmtime(embeddingsPath) < os.path.getmtime(representationsPath):
+                self._transcodeRepresentations(representationsPath, embeddingsPath, identitiesPath)
+
+            with open(identitiesPath) as f:
+                self._dbIdentities = json.load(f)
+
+            return np.load(embeddingsPath, mmap_mode="r")
+
+        def _transcodeRepresentations(self, representationsPath, embeddingsPath, identitiesPath):
+            with open(representationsPath, "rb") as f:
+                representations = pickle.load(f)
+
+            if len(representations) == 0:
+                embeddings = np.empty((0, 0), dtype=np.float32)
+            elif self._session is not None:
+                # Queries come from the quantized model, so the database goes through it too. Both sides then carry
+                # the same quantization error and DeepFace's threshold for the float model still separates them
+                embeddings = self._embedFaces([self._databaseFace(representation) for representation in representations])
+            else:
+                embeddings = self._normalize([representation["embedding"] for representation in representations])
+
+            # Write to temporary files and swap them in, so another process never maps a half-written
+            # file. Identities go first since the embeddings file's mtime marks the transcode as done.
+            with open(identitiesPath + ".tmp", "w") as f:
+                json.dump([representation["identity"] for representation in representations], f)
+            os.replace(identitiesPath + ".tmp", identitiesPath)
 
-        def _isBlackListed(self, numpyImage):
-            results = DeepFace.find(img_path=numpyImage, db_path=self._databaseFolder,silent=True, enforce_detection=False, model_name="SFace")
-            if results[0].empty:
-                return False
-            
-            return True
+            with open(embeddingsPath + ".tmp", "wb") as f:
+                np.save(f, embeddings)
+            os.replace(embeddingsPath + ".tmp", embeddingsPath)
+
+        def _databaseFace(self, representation):
+            # DeepFace records where it found the face in each database image, older caches don't and get the whole image
+            image = cv2.imread(representation["identity"])
+            if representation.get("target_w", 0) > 0 and representation.get("target_h", 0) > 0:
+                x, y = max(0, representation["target_x"]), max(0, representation["target_y"])
+                image = image[y:y + representation["target_h"], x:x + representation["target_w"]]
+            return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+        def _buildIndex(self):
+            if faiss is None or len(self._dbEmbeddings) == 0:
+                return None
+
+            # Inner product on normalized rows is cosine similarity
+            index = faiss.IndexFlatIP(self._dbEmbeddings.shape[1])
+            index.add(np.ascontiguousarray(self._dbEmbeddings))
+            return index
+
+        def _bestSimilarities(self, queries):
+            if self._index is not None:
+                similarities, indices = self._index.search(queries, 1)
+                return similarities[:, 0]
+
+            return (self._dbEmbeddings @ queries.T).max(axis=0)
+
+        def _embedFaces(self, faceImages):
+            batch = np.stack([cv2.resize(image, self._modelInputSize) for image in faceImages])
+
+            if self._session is not None:
+                # Crops are already RGB, which is what the network expects, laid out as NCHW float32
+                inputs = np.ascontiguousarray(batch.transpose(0, 3, 1, 2), dtype=np.float32)
+                return self._normalize(self._runSession(self._session, inputs))
+
+            results = DeepFace.represent(img_path=batch, model_name=self._modelName, detector_backend="skip", enforce_detection=False)
+            return self._normalize([result[0]["embedding"] for result in results])
+
+        def _recognitionLoop(self):
+            while True:
+                positions, faceImages, misses = self._requests.get()
+                if positions is None:
+                    return
+                # A result always goes back, otherwise _inFlight never clears and no face is submitted again.
+                # A failed batch counts as not blacklisted for one normal verdict lifetime, its miss streak unchanged,
+                # so it's retried later without the failure feeding the backoff
+                try:
+                    verdicts = self._bestSimilarities(self._embedFaces(faceImages)) > self._similarityThreshold
+                    misses = np.where(verdicts, 0, misses + 1).astype(np.int32)
+                except Exception as e:
+                    print(f"Error: face recognition failed: {e}")
+                    verdicts = np.zeros(len(positions), dtype=bool)
+                self._results.put((positions, verdicts, misses))
+
+        def _mergeRecognitionResults(self):
+            # Finished verdicts become cache entries at the positions the faces were seen at, fresh from age 0,
+            # with the miss streaks the worker worked out (a match resets it, a non-match extends it)
+            while True:
+                try:
+                    positions, verdicts, misses = self._results.get_nowait()
+                except queue.Empty:
+                    return
+                self._inFlight = False
+                self._cachedPositions = np.concatenate((self._cachedPositions, positions))
+                self._cachedVerdicts = np.concatenate((self._cachedVerdicts, verdicts))
+                self._cachedAges = np.concatenate((self._cachedAges, np.zeros(len(verdicts), dtype=np.int32)))
+                self._cachedMisses = np.concatenate((self._cachedMisses, misses))
+
+        def _clearVerdictCache(self):
+            # Position, verdict, age and non-match streak of every face in the previous frame, one row per face
+            self._cachedPositions = np.empty((0, 2), dtype=np.int32)
+            self._cachedVerdicts = np.empty(0, dtype=bool)
+            self._cachedAges = np.empty(0, dtype=np.int32)
+            self._cachedMisses = np.empty(0, dtype=np.int32)
+
+        def _verdictLifetimes(self, misses):
+            # The shift is clamped first so a long streak can't overflow before the cap applies
+            return np.minimum(self._maxVerdictAge << np.minimum(misses, 8), self._maxBackoffAge)
 
         def getBlackListedFacesInView(self):
             result, faces = self._fd.getAllFacesInView()
-            blackListedFaces = []
-            for face in faces:
-                if self._isBlackListed(face.getFace()):
-                    blackListedFaces.append(face)
-            return blackListedFaces
+            if len(faces) == 0 or len(self._dbEmbeddings) == 0:
+                self._clearVerdictCache()
+                return []
+
+            self._mergeRecognitionResults()
+
+            # Reuse last frame's verdict for faces that barely moved, only embed the rest
+            rectangles = np.array([face.getRectangle() for face in faces], dtype=np.int32)
+            positions = rectangles[:, :2]
+            deltas = positions[:, None, :] - self._cachedPositions[None, :, :]
+            nearby = (deltas * deltas).sum(axis=2) <= self._maxReuseDistance * self._maxReuseDistance
+            reusable = nearby & (self._cachedAges < self._verdictLifetimes(self._cachedMisses))
+            isCached = reusable.any(axis=1)
+
+            verdicts = np.zeros(len(faces), dtype=bool)
+            ages = np.zeros(len(faces), dtype=np.int32)
+            misses = np.zeros(len(faces), dtype=np.int32)
+            if isCached.any():
+                cachedRows = reusable.argmax(axis=1)[isCached]
+                verdicts[isCached] = self._cachedVerdicts[cachedRows]
+                ages[isCached] = self._cachedAges[cachedRows] + 1
+                misses[isCached] = self._cachedMisses[cachedRows]
+
+            # Faces without a fresh verdict get a stale age so they never stand in for a real one. An expired
+            # verdict nearby is still shown until its replacement comes back, so a match doesn't blink off.
+            # Distant faces skip the encoder altogether until they're closer.
+            # The streak carries over too, a face that loses its track starts again from zero.
+            ages[~isCached] = self._maxBackoffAge
+            isExpired = ~isCached & nearby.any(axis=1)
+            if isExpired.any():
+                expiredRows = nearby.argmax(axis=1)[isExpired]
+                verdicts[isExpired] = self._cachedVerdicts[expiredRows]
+                misses[isExpired] = self._cachedMisses[expiredRows]
+            uncached = np.flatnonzero(~isCached & (rectangles[:, 2] >= self._minFaceWidth))
+            if len(uncached) != 0 and not self._inFlight:
+                # One forward pass for every new face in view, then one matmul against the database.
+                # If the worker is still busy they're simply sent with a later frame.
+                self._requests.put((positions[uncached], [faces[i].getFace() for i in uncached], misses[uncached]))
+                self._inFlight = True
+
+            self._cachedPositions = positions
+            self._cachedVerdicts = verdicts
+            self._cachedAges = ages
+            self._cachedMisses = misses
+
+            return [face for face, isBlackListed in zip(faces, verdicts) if isBlackListed]
 
         def __del__(self):
+            # Never block here, a batch still waiting for the worker is dropped to make room for the stop request
+            try:
+                self._requests.put_nowait((None, None, None))
+            except queue.Full:
+                try:
+                    self._requests.get_nowait()
+                except queue.Empty:
+                    pass
+                self._requests.put_nowait((None, None, None))
             self._fd.stop_camera()
@@ -1,32 +1,89 @@
+import os
+import threading
 import cv2
 import numpy as np
 from Faces import Faces
 
 class FaceDetector:
-    def __init__(self, scale_factor=1.1, min_neighbors=5, min_size=(30, 30)):
+    def __init__(self, scale_factor=1.1, min_neighbors=5, min_size=(30, 30), detection_scale=0.5, equalize_histogram=False, adaptive_preprocessing=True,
+                 yunet_model="face_detection_yunet_2023mar.onnx", score_threshold=0.7, use_opencl=False):
         """Initialize the face detector with configurable parameters."""
-        # Load face detection classifier
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        # Load face detection model, YuNet from the OpenCV model zoo when its weights are present, otherwise the Haar cascade
+        self.face_cascade = None
+        self._yunet = None
+        if yunet_model is not None and os.path.exists(yunet_model):
+            if cv2.cuda.getCudaEnabledDeviceCount() > 0:
+                backend, target = cv2.dnn.DNN_BACKEND_CUDA, cv2.dnn.DNN_TARGET_CUDA_FP16
+            else:
+                backend, target = cv2.dnn.DNN_BACKEND_OPENCV, cv2.dnn.DNN_TARGET_CPU
+            # The input size is set per frame shape in _allocate_buffers
+            self._yunet = cv2.FaceDetectorYN.create(yunet_model, "", (320, 240), score_threshold=score_threshold, backend_id=backend, target_id=target)
+        else:
+            self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
         self.cap = None
         self.is_running = False
+        # True when the camera hands over raw packed YUYV frames instead of converted BGR
+        self._yuyv = False
+        
+        # Newest captured frame, written by the capture thread so reading the camera overlaps detection.
+        # Older frames that were never picked up are dropped.
+        self._frame_slot = None
+        self._frame_lock = threading.Lock()
+        self._frame_event = threading.Event()
+        self._capture_thread = None
         
         # Detection parameters
         self.scale_factor = scale_factor
         self.min_neighbors = min_neighbors
         self.min_size = min_size
         
+        # Faces are detected on a frame downscaled by this factor, boxes are mapped back to full resolution
+        self.detection_scale = detection_scale
+        self._detection_min_size = (max(1, int(min_size[0] * detection_scale)), max(1, int(min_size[1] * detection_scale)))
+        
+        # Histogram equalization is a full extra pass per frame and rarely helps the Haar cascade, off unless asked for
+        self.equalize_histogram = equalize_histogram
+        
+        # The cascade copes with raw input while it's finding faces, so the blur (and equalization, if enabled)
+        # only run on frames following one where nothing was found
+        self.adaptive_preprocessing = adaptive_preprocessing
+        self._last_face_count = 0
+        
+        # Preprocessing buffers, reused across frames and reallocated only when the frame shape changes
+        self._buffer_frame_shape = None
+        self._small_buf = None
+        self._gray_buf = None
+        self._blur_buf = None
+        
+        # Run preprocessing and the cascade through OpenCV's OpenCL path, opt-in since it's usually slower on ARM boards.
+        # The switch is process wide, so it's only touched when asked for and a device is there
+        self.use_opencl = use_opencl and cv2.ocl.haveOpenCL()
+        if self.use_opencl:
+            cv2.ocl.setUseOpenCL(True)
+        
         # Verify classifier loading
-        if self.face_cascade.empty():
+        if self.face_cascade is not None and self.face_cascade.empty():
             raise RuntimeError("Error: Couldn't load face cascade classifier")
             
-    def start_camera(self, camera_id=0, resolution=(640, 480)):
-        """Start the camera with specified settings."""
+    def start_camera(self, camera_id=0, resolution=(640, 480), raw_yuyv=True):
+        """Start the camera with specified settings, taking raw YUYV frames when the backend allows it."""
         try:
             self._cap = cv2.VideoCapture(camera_id)
             if not self._cap.isOpened():
                 print("Error: Could not open camera")
                 return False
                 
+            # Raw YUYV is two bytes a pixel with the luma detection needs already separated,
+            # the backend's BGR conversion is skipped and only face crops are ever converted to color
+            # (YuNet needs color at detection scale though, which packed YUYV can't be downscaled into directly)
+            if raw_yuyv and self._yunet is None:
+                yuyv = cv2.VideoWriter_fourcc(*'YUYV')
+                self._cap.set(cv2.CAP_PROP_FOURCC, yuyv)
+                self._cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+                self._yuyv = int(self._cap.get(cv2.CAP_PROP_FOURCC)) == yuyv and self._cap.get(cv2.CAP_PROP_CONVERT_RGB) == 0
+                if not self._yuyv:
+                    self._cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+
             # Set camera properties
             self._cap.set(cv2.CAP_PROP_FRAME_WIDTH, resolution[0])
             self._cap.set(cv2.CAP_PROP_FRAME_HEIGHT, resolution[1])
@@ -41,15 +98,28 @@ class FaceDetector:
 
             print(f"Camera initialized at resolution: {actual_width}x{actual_height}")
             self.is_running = True
+            self._capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
+            self._capture_thread.start()
             return True
             
         except Exception as e:
             print(f"Error initializing camera: {e}")
             return False
 
+    def _capture_loop(self):
+        """Read frames into the slot until the camera is stopped, None marks a failed read."""
+        while self.is_running:
+            ret, frame = self._cap.read()
+            with self._frame_lock:
+                self._frame_slot = frame if ret else None
+                self._frame_event.set()
+
     def stop_camera(self):
         """Stop the camera and clean up resources."""
         self.is_running = False
+        if self._capture_thread is not None:
+            self._capture_thread.join()
+            self._capture_thread = None
         if self._cap is not None:
             self._cap.release()
         cv2.destroyAllWindows()
@@ -58,47 +128,127 @@ class FaceDetector:
         for i in range(5):
             cv2.waitKey(1)
 
+    def _allocate_buffers(self, frame):
+        """Allocate the preprocessing buffers for frames of this shape."""
+        width = max(1, round(frame.shape[1] * self.detection_scale))
+        height = max(1, round(frame.shape[0] * self.detection_scale))
+        self._small_buf = np.empty((height, width, frame.shape[2]), dtype=frame.dtype)
+        self._gray_buf = np.empty((height, width), dtype=np.uint8)
+        self._blur_buf = np.empty((height, width), dtype=np.uint8)
+        self._buffer_frame_shape = frame.shape
+        if self._yunet is not None:
+            self._yunet.setInputSize((width, height))
+
+    def _needs_filtering(self):
+        """Whether this frame gets the equalize and blur passes."""
+        return not self.adaptive_preprocessing or self._last_face_count == 0
+
+    def _preprocess(self, frame):
+        """Downscale, grayscale, optionally equalize and blur the frame into the reused host buffers."""
+        if frame.shape != self._buffer_frame_shape:
+            self._allocate_buffers(frame)
+        
+        cv2.resize(frame, (self._small_buf.shape[1], self._small_buf.shape[0]), dst=self._small_buf, interpolation=cv2.INTER_AREA)
+        if self._yuyv:
+            # Channel 0 of a packed YUYV frame is the luma, averaging it down is already the grayscale image
+            cv2.extractChannel(self._small_buf, 0, dst=self._gray_buf)
+        else:
+            cv2.cvtColor(self._small_buf, cv2.COLOR_BGR2GRAY, dst=self._gray_buf)
+        if not self._needs_filtering():
+            return self._gray_buf
+        
+        if self.equalize_histogram:
+            cv2.equalizeHist(self._gray_buf, dst=self._gray_buf)  # Improve contrast
+        
+        # Optional: Add Gaussian blur to reduce noise
+        cv2.GaussianBlur(self._gray_buf, (5, 5), 0, dst=self._blur_buf)
+        return self._blur_buf
+
+    def _preprocess_opencl(self, frame):
+        """Same preprocessing as _preprocess, kept on the OpenCL device as a UMat."""
+        small = cv2.resize(cv2.UMat(frame), None, fx=self.detection_scale, fy=self.detection_scale, interpolation=cv2.INTER_AREA)
+        gray = cv2.extractChannel(small, 0) if self._yuyv else cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        if not self._needs_filtering():
+            return gray
+        if self.equalize_histogram:
+            gray = cv2.equalizeHist(gray)
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def _detect_faces_yunet(self, frame):
+        """Detect faces with YuNet, which takes the downscaled BGR frame as is."""
+        if frame.shape != self._buffer_frame_shape:
+            self._allocate_buffers(frame)
+        
+        cv2.resize(frame, (self._small_buf.shape[1], self._small_buf.shape[0]), dst=self._small_buf, interpolation=cv2.INTER_AREA)
+        _, detections = self._yunet.detect(self._small_buf)
+        if detections is None:
+            return np.empty((0, 4))
+        
+        # Boxes can start slightly outside the frame, clamp them so crops stay inside it
+        faces = detections[:, :4]
+        faces[:, :2] = np.maximum(faces[:, :2], 0)
+        return faces
+
     def _detect_faces(self, frame):
         """Detect faces in the frame."""
         try:
-            # Image preprocessing
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            gray = cv2.equalizeHist(gray)  # Improve contrast
+            if self._yunet is not None:
+                faces = self._detect_faces_yunet(frame)
+                if len(faces) == 0:
+                    return np.empty((0, 4), dtype=np.int32)
+                return (faces / self.detection_scale).astype(np.int32)
             
-            # Optional: Add Gaussian blur to reduce noise
-            gray = cv2.GaussianBlur(gray, (5, 5), 0)
+            # Image preprocessing
+            if self.use_opencl:
+                prepared = self._preprocess_opencl(frame)
+            else:
+                prepared = self._preprocess(frame)
             
             # Detect faces
             faces = self.face_cascade.detectMultiScale(
-                gray,
+                prepared,
                 scaleFactor=self.scale_factor,
                 minNeighbors=self.min_neighbors,
-                minSize=self.min_size,
+                minSize=self._detection_min_size,
                 flags=cv2.CASCADE_SCALE_IMAGE
             )
             
-            return faces
+            self._last_face_count = len(faces)
+            if len(faces) == 0:
+                return np.empty((0, 4), dtype=np.int32)
+            
+            # Map boxes back to the full resolution frame as an (N, 4) int32 array of x, y, w, h
+            return (faces / self.detection_scale).astype(np.int32)
             
         except Exception as e:
             print(f"Error during face detection: {e}")
-            return []
+            return np.empty((0, 4), dtype=np.int32)
 
 
 
     def getAllFacesInView(self):
         try:
-            ret, image = self._cap.read()
-            if not ret:
+            # Wait for a frame newer than the last one handed out
+            if not self._frame_event.wait(timeout=1.0):
                 return False, []
+            with self._frame_lock:
+                image = self._frame_slot
+                self._frame_event.clear()
+            if image is None:
+                return False, []
+            
+            if self._yuyv:
+                # The raw buffer comes back flat, view it as rows of (luma, chroma) pairs
+                image = image.reshape(int(self._resolution[1]), int(self._resolution[0]), 2)
             
             faces = self._detect_faces(image)
 
             output = []
 
-            for face in faces:
-                x, y, w, h = face
-                croppedFaceImageData = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)[y:y+h, x:x+w]
-                output.append(Faces(croppedFaceImageData, x, y, w, h, self._resolution))
+            # Faces keep a reference to the frame and only cut their crop out when its pixels are needed
+            toRgb = cv2.COLOR_YUV2RGB_YUYV if self._yuyv else cv2.COLOR_BGR2RGB
+            for x, y, w, h in faces.tolist():
+                output.append(Faces(image, x, y, w, h, self._resolution, toRgb))
 
             return True, output
 
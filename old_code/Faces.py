@@ -1,10 +1,26 @@
+import cv2
+
 class Faces:
-    def __init__(self, croppedFaceImageData, x,y,w,h, screenSize):
-        self._image = croppedFaceImageData
+    # frame is the whole camera frame (BGR unless toRgb says otherwise), the face is only cut out and
+    # converted to RGB if getFace is called. The frame isn't reused by the camera, so holding on to it is safe.
+    def __init__(self, frame, x,y,w,h, screenSize, toRgb=cv2.COLOR_BGR2RGB):
+        self._frame = frame
+        self._toRgb = toRgb
+        self._image = None
         self._rectangle = (x,y,w,h)
         self._screenSize = screenSize
 
     def getFace(self):
+        if self._image is None:
+            x,y,w,h = self._rectangle
+            if self._toRgb == cv2.COLOR_YUV2RGB_YUYV:
+                # Chroma is shared by pixel pairs, so the crop is widened to start and end on a pair boundary
+                crop = self._frame[y:y+h, x & ~1:(x+w+1) & ~1]
+            else:
+                crop = self._frame[y:y+h, x:x+w]
+            self._image = cv2.cvtColor(crop, self._toRgb)
+            # Let go of the frame, the converted crop is all that's needed from now on
+            self._frame = None
         return self._image
     
     def getRectangle(self):
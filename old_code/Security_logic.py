@@ -1,52 +1,115 @@
 import time
+import logging
 import cv2
+import queue
+import threading
 import traceback
 import math
-import random
-from shapely.geometry import Point, Polygon
+import os
+from dataclasses import dataclass
+import numpy as np
+import shapely
+from shapely.geometry import Polygon
 from map_store import MapStore
 
+# Per-command motor messages go through logging at DEBUG, so nothing is formatted or written unless enabled
+log = logging.getLogger(__name__)
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+def _rects_to_world(rects, frame_width, frame_height, robot_x, robot_y, robot_orientation):
+    """
+    Convert obstacle bounding boxes to world coordinates relative to the robot (simplified).
+
+    Args:
+        rects: (N, 4) int32 array of x, y, w, h bounding boxes in image coordinates.
+        frame_width, frame_height: Size of the image the boxes come from.
+        robot_x, robot_y, robot_orientation: Current robot pose, orientation in degrees.
+
+    Returns:
+        tuple: world_x, world_y, distance and world_angle arrays, one entry per box.
+    """
+    x, y, w, h = rects[:, 0], rects[:, 1], rects[:, 2], rects[:, 3]
+    # Obstacle position relative to the image center, Y is inverted in image coordinates
+    rel_x = (x + w // 2 - frame_width // 2).astype(np.float64)
+    rel_y = (frame_height // 2 - (y + h // 2)).astype(np.float64)
+
+    distance = np.hypot(rel_x, rel_y)
+    world_angle = np.mod(robot_orientation + np.degrees(np.arctan2(rel_y, rel_x)), 360.0)
+    world_radians = np.radians(world_angle)
+    world_x = robot_x + distance * np.cos(world_radians)
+    world_y = robot_y + distance * np.sin(world_radians)
+    return world_x, world_y, distance, world_angle
+
+if njit is not None:
+    # Compiled eagerly at import so the first frame with obstacles doesn't pay for it
+    _rects_to_world = njit("UniTuple(f8[::1], 4)(i4[:, ::1], i8, i8, f8, f8, f8)", cache=True, fastmath=True)(_rects_to_world)
+
+class _RecordPool:
+    """
+    Free list of dictionaries for the short-lived obstacle records built every frame.
+    """
+    def __init__(self):
+        self._free = []
+
+    def acquire(self):
+        return self._free.pop() if self._free else {}
+
+    def release(self, records):
+        for record in records:
+            record.clear()
+            self._free.append(record)
+
 # ---------------------------- Configuration Class ----------------------------
+@dataclass(frozen=True, slots=True)
 class Configuration:
-    def __init__(self):
-        # Communication and database settings
-        self.SERIAL_PORT = '/dev/ttyUSB0'          # Robot serial port
-        self.BAUD_RATE = 115200                    # Baud rate
-        self.DATABASE_FOLDER = 'path/to/database'   # Face database path
-
-        # Motion control parameters
-        self.ALIGNMENT_THRESHOLD = 20              # Permissible deviation in pixels for target alignment
-        self.TURN_SPEED = 1000                     # Maximum turning speed
-        self.SCAN_ROTATION_SPEED = 500             # Rotation speed during scanning
-        self.FIRE_DURATION = 1                     # Firing duration (in seconds)
-        self.FORWARD_SPEED = 800                   # Forward movement speed
-        self.BACKWARD_SPEED = 600                  # Backward movement speed
-
-        # Safety parameters
-        self.SAFE_DISTANCE = 50                    # Minimum safe distance from obstacles (units depend on implementation)
-        self.SCAN_INTERVAL = 0.1                   # Interval between scans
-        self.OBSTACLE_AREA_THRESHOLD = 1000        # Minimum area for contours to be considered obstacles
-        self.FULL_SCAN_ANGLE = 360                 # Full rotation angle for scanning (degrees)
-        self.SCAN_STEP_ANGLE = 10                  # Rotation angle per step during scanning (degrees)
-
-        # Electronic fence (allowed patrol area), e.g., a rectangular region defined by coordinates
-        self.PATROL_AREA = [(0, 0), (640, 0), (640, 480), (0, 480)]
+    # Communication and database settings
+    SERIAL_PORT: str = '/dev/ttyUSB0'          # Robot serial port
+    BAUD_RATE: int = 115200                    # Baud rate
+    DATABASE_FOLDER: str = 'path/to/database'   # Face database path
+
+    # Motion control parameters
+    ALIGNMENT_THRESHOLD: float = 20            # Permissible deviation in pixels for target alignment
+    TURN_SPEED: float = 1000                   # Maximum turning speed
+    SCAN_ROTATION_SPEED: float = 500           # Rotation speed during scanning
+    FIRE_DURATION: float = 1                   # Firing duration (in seconds)
+    FORWARD_SPEED: float = 800                 # Forward movement speed
+    BACKWARD_SPEED: float = 600                # Backward movement speed
+
+    # Safety parameters
+    SAFE_DISTANCE: float = 50                  # Minimum safe distance from obstacles (units depend on implementation)
+    SCAN_INTERVAL: float = 0.1                 # Interval between scans
+    OBSTACLE_AREA_THRESHOLD: float = 1000      # Minimum area for blobs to be considered obstacles
+    OBSTACLE_DETECTION_SCALE: float = 0.5      # Frames are downscaled by this factor before obstacle detection (1 = full resolution)
+    FULL_SCAN_ANGLE: float = 360               # Full rotation angle for scanning (degrees)
+    SCAN_STEP_ANGLE: float = 10                # Rotation angle per step during scanning (degrees)
+    OBSTACLE_MERGE_DISTANCE: float = 20        # Obstacles detected in the same grid cell of this size are stored once
+    OBSTACLE_MAX_BLOBS: int = 1000             # Frames splitting into more blobs than this are treated as noise
+    OBSTACLE_USE_OPENCL: bool = False          # Run obstacle preprocessing through OpenCV's OpenCL path (needs a GPU/iGPU)
+
+    # Electronic fence (allowed patrol area), e.g., a rectangular region defined by coordinates
+    PATROL_AREA: tuple = ((0, 0), (640, 0), (640, 480), (0, 480))
+
+    # Settings that must be positive numbers
+    _POSITIVE_FIELDS = ('ALIGNMENT_THRESHOLD', 'TURN_SPEED', 'SCAN_ROTATION_SPEED', 'FIRE_DURATION',
+                        'SAFE_DISTANCE', 'SCAN_INTERVAL', 'FORWARD_SPEED', 'BACKWARD_SPEED',
+                        'OBSTACLE_AREA_THRESHOLD', 'OBSTACLE_DETECTION_SCALE', 'FULL_SCAN_ANGLE',
+                        'SCAN_STEP_ANGLE', 'OBSTACLE_MERGE_DISTANCE', 'OBSTACLE_MAX_BLOBS')
+
+    def __post_init__(self):
+        self.validate()
 
     def validate(self):
         """
         Validate the configuration parameters.
         """
-        assert isinstance(self.ALIGNMENT_THRESHOLD, (int, float)) and self.ALIGNMENT_THRESHOLD > 0
-        assert isinstance(self.TURN_SPEED, (int, float)) and self.TURN_SPEED > 0
-        assert isinstance(self.SCAN_ROTATION_SPEED, (int, float)) and self.SCAN_ROTATION_SPEED > 0
-        assert isinstance(self.FIRE_DURATION, (int, float)) and self.FIRE_DURATION > 0
-        assert isinstance(self.SAFE_DISTANCE, (int, float)) and self.SAFE_DISTANCE > 0
-        assert isinstance(self.SCAN_INTERVAL, (int, float)) and self.SCAN_INTERVAL > 0
-        assert isinstance(self.FORWARD_SPEED, (int, float)) and self.FORWARD_SPEED > 0
-        assert isinstance(self.BACKWARD_SPEED, (int, float)) and self.BACKWARD_SPEED > 0
-        assert isinstance(self.OBSTACLE_AREA_THRESHOLD, (int, float)) and self.OBSTACLE_AREA_THRESHOLD > 0
-        assert isinstance(self.FULL_SCAN_ANGLE, (int, float)) and self.FULL_SCAN_ANGLE > 0
-        assert isinstance(self.SCAN_STEP_ANGLE, (int, float)) and self.SCAN_STEP_ANGLE > 0
+        for name in self._POSITIVE_FIELDS:
+            value = getattr(self, name)
+            assert isinstance(value, (int, float)) and value > 0, name
+        assert self.OBSTACLE_DETECTION_SCALE <= 1, 'OBSTACLE_DETECTION_SCALE'
 
 # ---------------------------- Simulated Face Detection and Blacklist Recognition ----------------------------
 class FakeBlackList:
@@ -60,11 +123,27 @@ class FakeBlackList:
         self.cap = cv2.VideoCapture(0)
         if not self.cap.isOpened():
             raise Exception("Unable to open the camera")
+        # Only hold the newest frame so obstacle detection never works on stale ones
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
         
         # For simulation purposes, occasionally return a fake detection
         self.detection_counter = 0
         self.frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         self.frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        
+        # Frames are decoded into reused buffers instead of a fresh array per read. A buffer only goes back on
+        # the free list through release_frame, so one still queued or in use is never overwritten. Four covers
+        # the one being filled, the two the detection queue can hold and the one the main loop is using.
+        self._free_frames = queue.Queue()
+        for _ in range(4):
+            self._free_frames.put(np.empty((self.frame_height, self.frame_width, 3), dtype=np.uint8))
+        
+        # Fake face positions are drawn up front as rows of (x, y, width) and cycled through
+        rng = np.random.default_rng()
+        widths = rng.integers(80, 120, size=4096, endpoint=True)
+        self._fake_faces = np.stack([rng.integers(0, self.frame_width - widths, endpoint=True),
+                                     rng.integers(0, self.frame_height - widths, endpoint=True),
+                                     widths], axis=1).tolist()
     
     def getBlackListedFacesInView(self):
         """
@@ -76,10 +155,8 @@ class FakeBlackList:
         # In a real implementation, you would use actual face detection here
         # For simulation, return a fake detection occasionally
         if self.detection_counter % 50 == 0:
-            # Generate random face position with appropriate structure
-            fake_face_width = random.randint(80, 120)
-            fake_face_x = random.randint(0, self.frame_width - fake_face_width)
-            fake_face_y = random.randint(0, self.frame_height - fake_face_width)
+            # Take the next pre-drawn face position
+            fake_face_x, fake_face_y, fake_face_width = self._fake_faces[self.detection_counter // 50 % len(self._fake_faces)]
             
             return [{
                 '_resolution': (self.frame_width, self.frame_height),
@@ -92,15 +169,30 @@ class FakeBlackList:
             }]
         return []
     
-    def get_current_frame(self):
+    def get_current_frame(self, timeout=None):
         """
-        Get the current frame from the camera.
+        Get the current frame from the camera, hand it back with release_frame once done with it.
+        Waits up to timeout seconds for a free buffer and returns None if none comes back.
         """
-        ret, frame = self.cap.read()
-        if ret:
-            return frame
-        else:
+        try:
+            buffer = self._free_frames.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if not self.cap.grab():
+            self._free_frames.put(buffer)
+            return None
+        ret, frame = self.cap.retrieve(buffer)
+        if not ret:
+            self._free_frames.put(buffer)
             return None
+        return frame
+
+    def release_frame(self, frame):
+        """
+        Return a frame from get_current_frame so its buffer can be filled again.
+        """
+        if frame is not None:
+            self._free_frames.put(frame)
     
     def cleanup(self):
         """
@@ -128,17 +220,34 @@ class SecurityRobot:
         self.left_speed = 0
         self.right_speed = 0
         self.is_moving = False
+        # cos/sin of the orientation they were computed for, refreshed only when the orientation changes
+        self._trig_orientation = 0
+        self._cos = 1.0
+        self._sin = 0.0
+        # Notified whenever the pose changes, so waiting code wakes up on movement instead of polling
+        self._pose_changed = threading.Condition()
 
     def set_left_stepper(self, speed):
         self.left_speed = speed
         self.is_moving = (self.left_speed != 0 or self.right_speed != 0)
-        print(f"Setting left stepper motor speed to: {speed}")
+        log.debug("Setting left stepper motor speed to: %s", speed)
         self._update_position()
 
     def set_right_stepper(self, speed):
         self.right_speed = speed
         self.is_moving = (self.left_speed != 0 or self.right_speed != 0)
-        print(f"Setting right stepper motor speed to: {speed}")
+        log.debug("Setting right stepper motor speed to: %s", speed)
+        self._update_position()
+
+    def set_steppers(self, left_speed, right_speed):
+        """
+        Set both stepper motor speeds, then update the simulated position once for the pair.
+        """
+        self.left_speed = left_speed
+        self.right_speed = right_speed
+        self.is_moving = (self.left_speed != 0 or self.right_speed != 0)
+        log.debug("Setting left stepper motor speed to: %s", left_speed)
+        log.debug("Setting right stepper motor speed to: %s", right_speed)
         self._update_position()
 
     def _update_position(self):
@@ -158,45 +267,54 @@ class SecurityRobot:
         # Calculate forward/backward movement (average of both motor speeds)
         avg_speed = (self.left_speed + self.right_speed) / 2
         if avg_speed != 0:
-            # Convert orientation to radians for trig functions
-            orientation_rad = math.radians(self.orientation)
+            if self.orientation != self._trig_orientation:
+                # Convert orientation to radians for trig functions
+                orientation_rad = math.radians(self.orientation)
+                self._cos = math.cos(orientation_rad)
+                self._sin = math.sin(orientation_rad)
+                self._trig_orientation = self.orientation
             # Calculate new position based on orientation and speed
-            dx = math.cos(orientation_rad) * avg_speed / 5000.0  # Scale down for simulation
-            dy = math.sin(orientation_rad) * avg_speed / 5000.0
+            dx = self._cos * avg_speed / 5000.0  # Scale down for simulation
+            dy = self._sin * avg_speed / 5000.0
             self.position = (self.position[0] + dx, self.position[1] + dy)
-            print(f"Robot moved to position: {self.position}, orientation: {self.orientation}°")
+            log.debug("Robot moved to position: %s, orientation: %s°", self.position, self.orientation)
+        
+        with self._pose_changed:
+            self._pose_changed.notify_all()
+
+    def wait_for_pose_change(self, timeout):
+        """
+        Block until the robot's position or orientation changes, or until timeout seconds pass.
+        """
+        with self._pose_changed:
+            self._pose_changed.wait(timeout)
 
     def move_forward(self, speed):
-        self.set_left_stepper(speed)
-        self.set_right_stepper(speed)
-        print(f"Moving forward at speed: {speed}")
+        self.set_steppers(speed, speed)
+        log.debug("Moving forward at speed: %s", speed)
 
     def move_backward(self, speed):
-        self.set_left_stepper(-speed)
-        self.set_right_stepper(-speed)
-        print(f"Moving backward at speed: {speed}")
+        self.set_steppers(-speed, -speed)
+        log.debug("Moving backward at speed: %s", speed)
 
     def turn_left(self, speed):
-        self.set_left_stepper(-speed)
-        self.set_right_stepper(speed)
-        print(f"Turning left at speed: {speed}")
+        self.set_steppers(-speed, speed)
+        log.debug("Turning left at speed: %s", speed)
 
     def turn_right(self, speed):
-        self.set_left_stepper(speed)
-        self.set_right_stepper(-speed)
-        print(f"Turning right at speed: {speed}")
+        self.set_steppers(speed, -speed)
+        log.debug("Turning right at speed: %s", speed)
 
     def toggle_nerf_gun(self, active: bool):
         if active:
-            print("Activating Nerf gun")
+            log.debug("Activating Nerf gun")
         else:
-            print("Deactivating Nerf gun")
+            log.debug("Deactivating Nerf gun")
 
     def stop_everything(self):
-        self.set_left_stepper(0)
-        self.set_right_stepper(0)
+        self.set_steppers(0, 0)
         self.is_moving = False
-        print("Stopping all movements")
+        log.debug("Stopping all movements")
 
     def get_position(self):
         return self.position
@@ -211,13 +329,25 @@ class SecurityRobot:
 class SecuritySystem:
     def __init__(self, config: Configuration):
         self.config = config
-        self.config.validate()
 
         # Initialize the electronic fence (patrol area)
         self.patrol_area = Polygon(self.config.PATROL_AREA)
+        # Build the polygon's spatial index once, every point-in-area check reuses it
+        shapely.prepare(self.patrol_area)
+        # Points outside the bounding box are rejected with plain comparisons, and for an
+        # axis-aligned rectangular fence the bounding box check is the whole answer
+        self.patrol_bounds = self.patrol_area.bounds
+        self.patrol_is_rectangle = self.patrol_area.equals(shapely.box(*self.patrol_bounds))
+        # The centroid of the patrol area is where the robot heads when it leaves the fence
+        centroid = self.patrol_area.centroid
+        self.safe_point = (centroid.x, centroid.y)
         
         # Initialize map storage
         self.map_store = MapStore()
+        # Grid cells that already hold a stored obstacle, so repeated sightings aren't added again
+        self.known_obstacle_cells = set()
+        # Obstacle dictionaries handed out by continue_scan, returned once the frame has been handled
+        self.obstacle_pool = _RecordPool()
 
         # Initialize the blacklist detection module (simulated)
         try:
@@ -239,10 +369,94 @@ class SecuritySystem:
         self.current_scan_angle = 0
         self.scan_in_progress = False
         self.state = "IDLE"  # States: IDLE, SCANNING, TRACKING, AVOIDING
+
+        # Capture/detection runs on its own thread and hands (frame, blacklisted_faces, obstacle_rects) to the main loop
+        self.detection_queue = queue.Queue(maxsize=2)
+        # The newest non-empty blacklisted_faces, kept apart so a face hit survives its queue entry being dropped
+        self._pending_faces = None
+        self._pending_faces_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
+
+        # Keep the control loop on core 0 and capture/inference on the remaining cores so neither migrates
+        cpu_count = os.cpu_count() or 1
+        self.control_cores = {0}
+        self.inference_cores = set(range(1, cpu_count)) if cpu_count > 1 else {0}
         
         # Add the initial robot position to the map
         self._update_robot_position_in_map()
 
+    def _capture_loop(self):
+        """
+        Producer thread: grab a frame and run blacklist detection on it, so capture and
+        inference overlap with the decision/actuation work in the main loop.
+        Paced to SCAN_INTERVAL, the main loop never takes detections faster than that.
+        """
+        self._pin_current_thread(self.inference_cores)
+        next_capture = time.monotonic()
+        while not self.stop_event.is_set():
+            remaining = next_capture - time.monotonic()
+            if remaining > 0 and self.stop_event.wait(remaining):
+                break
+            next_capture = max(next_capture + self.config.SCAN_INTERVAL, time.monotonic())
+            frame = None
+            try:
+                # Only waits if a buffer is never handed back, dropping a queued detection releases its frame
+                frame = self.blacklist.get_current_frame(timeout=1)
+                blacklisted_faces = self.blacklist.getBlackListedFacesInView()
+                # Thresholding and blob labelling only needs the frame, so it runs here and the control
+                # loop just places the resulting boxes around the robot's pose
+                obstacle_rects = self._find_obstacle_rects(frame) if frame is not None else None
+                if blacklisted_faces:
+                    with self._pending_faces_lock:
+                        self._pending_faces = blacklisted_faces
+                self._publish_detection((frame, blacklisted_faces, obstacle_rects))
+                # The queue owns the frame now
+                frame = None
+            except Exception as e:
+                print(f"Error in capture loop: {e}")
+                traceback.print_exc()
+                self.blacklist.release_frame(frame)
+                self.stop_event.wait(1)
+
+    def _pin_current_thread(self, cores):
+        """
+        Restrict the calling thread to the given CPU cores where the platform supports it.
+        """
+        if not hasattr(os, "sched_setaffinity"):
+            return
+        try:
+            os.sched_setaffinity(0, cores)
+        except OSError as e:
+            print(f"Unable to set CPU affinity {cores}: {e}")
+
+    def _publish_detection(self, detection):
+        """
+        Queue a detection for the main loop, dropping the oldest one when the queue is full.
+        """
+        while True:
+            try:
+                self.detection_queue.put_nowait(detection)
+                return
+            except queue.Full:
+                try:
+                    dropped = self.detection_queue.get_nowait()
+                except queue.Empty:
+                    continue
+                self.blacklist.release_frame(dropped[0])
+
+    def _take_pending_faces(self):
+        """
+        Take the newest face hit the capture thread saw, so one whose queue entry was dropped still gets handled.
+
+        Returns:
+            list: The blacklisted faces, empty if there was no hit since the last call.
+        """
+        with self._pending_faces_lock:
+            faces = self._pending_faces
+            self._pending_faces = None
+        return faces or []
+
     def _update_robot_position_in_map(self):
         """
         Update the robot's position in the map store.
@@ -266,17 +480,21 @@ class SecuritySystem:
         Returns:
             bool: True if the point is within the area.
         """
-        point = Point(x, y)
-        return self.patrol_area.contains(point)
+        # Strict comparisons, like Polygon.contains a point on the fence itself is outside
+        min_x, min_y, max_x, max_y = self.patrol_bounds
+        if not (min_x < x < max_x and min_y < y < max_y):
+            return False
+        if self.patrol_is_rectangle:
+            return True
+        # contains_xy tests the raw coordinates against the prepared polygon without building a Point
+        return bool(shapely.contains_xy(self.patrol_area, x, y))
     
     def _return_to_safe_zone(self):
         """
         Return the robot to a safe position within the patrol area.
         This is a simplified implementation - in a real system, path planning would be needed.
         """
-        # Get the centroid of the patrol area as a safe point
-        centroid = self.patrol_area.centroid
-        safe_point = (centroid.x, centroid.y)
+        safe_point = self.safe_point
         
         # Stop current movement
         self.robot.stop_everything()
@@ -300,7 +518,7 @@ class SecuritySystem:
             
         # Wait until approximately facing the right direction
         while abs(angle_diff) > 10:
-            time.sleep(0.1)
+            self.robot.wait_for_pose_change(0.1)
             current_angle = self.robot.get_orientation()
             angle_diff = (target_angle - current_angle + 180) % 360 - 180
         
@@ -309,7 +527,7 @@ class SecuritySystem:
         
         # Wait until we're close to the safe point
         while not self.is_within_patrol_area(*self.robot.get_position()):
-            time.sleep(0.1)
+            self.robot.wait_for_pose_change(0.1)
             self._update_robot_position_in_map()
         
         # Stop when we're back in the patrol area
@@ -361,11 +579,9 @@ class SecuritySystem:
             if abs(error) > self.config.ALIGNMENT_THRESHOLD:
                 turn_speed = self.calculate_turn_speed(error, frame_width)
                 if error > 0:
-                    self.robot.set_left_stepper(turn_speed)
-                    self.robot.set_right_stepper(-turn_speed)
+                    self.robot.set_steppers(turn_speed, -turn_speed)
                 else:
-                    self.robot.set_left_stepper(-turn_speed)
-                    self.robot.set_right_stepper(turn_speed)
+                    self.robot.set_steppers(-turn_speed, turn_speed)
                 self.robot.toggle_nerf_gun(False)
                 return False
             else:
@@ -387,7 +603,7 @@ class SecuritySystem:
     def detect_obstacle(self, frame):
         """
         Use OpenCV to detect obstacles in the captured image.
-        This simplified example applies Canny edge detection and contour finding, considering larger contours as obstacles.
+        This simplified example splits the image into blobs with Otsu thresholding, considering larger blobs as obstacles.
 
         Args:
             frame: The image captured from the camera.
@@ -395,54 +611,105 @@ class SecuritySystem:
         Returns:
             list: A list of obstacle information dictionaries, each containing 'id', 'position', and 'size'.
         """
-        obstacles_found = []
         if frame is None:
-            return obstacles_found
+            return []
+        return self._obstacles_from_rects(frame.shape, *self._find_obstacle_rects(frame))
 
+    def _find_obstacle_rects(self, frame):
+        """
+        Image half of obstacle detection: find the blobs large enough to be obstacles.
+        Only touches the frame, so the capture thread runs it off the control loop.
+
+        Args:
+            frame: The image captured from the camera.
+
+        Returns:
+            tuple: Blob labels and an (N, 4) int32 array of their x, y, w, h bounding boxes.
+                Empty for a frame with more than OBSTACLE_MAX_BLOBS blobs.
+        """
         try:
+            # Resize, gray conversion and thresholding stay on the OpenCL device, only the binary mask comes back
+            use_opencl = self.config.OBSTACLE_USE_OPENCL and cv2.ocl.haveOpenCL()
+            if use_opencl:
+                frame = cv2.UMat(frame)
+            # Blobs don't need full resolution, work on a downscaled frame and map the boxes back
+            scale = self.config.OBSTACLE_DETECTION_SCALE
+            if scale != 1:
+                frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
             gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-            edged = cv2.Canny(blurred, 50, 150)
-            contours, _ = cv2.findContours(edged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+            if use_opencl:
+                binary = binary.get()
+            # One labelling pass yields every blob's bounding box and pixel area, no contour tracing needed
+            blob_count, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8, ltype=cv2.CV_32S)
+            # A noise-saturated frame (sensor noise, flicker) splits into thousands of specks, nothing is read
+            # into it. Boxes from an earlier frame would be placed around the current pose, and during a scan
+            # rotation that maps them somewhere they never were
+            if blob_count - 1 > self.config.OBSTACLE_MAX_BLOBS:
+                return (np.empty(0, dtype=np.intp), np.empty((0, 4), dtype=np.int32))
             
-            for idx, contour in enumerate(contours):
-                area = cv2.contourArea(contour)
-                # Determine if the contour is an obstacle based on its area
-                if area > self.config.OBSTACLE_AREA_THRESHOLD:
-                    x, y, w, h = cv2.boundingRect(contour)
-                    # Convert from image coordinates to world coordinates (simplified)
-                    # In a real system, you would use proper coordinate transformation
-                    robot_pos = self.robot.get_position()
-                    robot_orient = self.robot.get_orientation()
-                    
-                    # Calculate obstacle position relative to robot
-                    # This is a very simplified transformation - in reality, would be more complex
-                    rel_x = x + w // 2 - frame.shape[1] // 2
-                    rel_y = frame.shape[0] // 2 - (y + h // 2)  # Y is inverted in image coordinates
-                    
-                    # Convert to angle and distance
-                    distance = math.sqrt(rel_x**2 + rel_y**2)
-                    angle = math.degrees(math.atan2(rel_y, rel_x))
-                    
-                    # Transform to world coordinates
-                    world_angle = (robot_orient + angle) % 360
-                    world_x = robot_pos[0] + distance * math.cos(math.radians(world_angle))
-                    world_y = robot_pos[1] + distance * math.sin(math.radians(world_angle))
-                    
-                    obstacle = {
-                        'id': f'obstacle_{int(time.time())}_{idx}',
-                        'position': (world_x, world_y),
-                        'size': (w, h),
-                        'distance': distance,
-                        'angle': world_angle
-                    }
-                    obstacles_found.append(obstacle)
+            # Determine which blobs are obstacles based on their full resolution area, label 0 is the background
+            indices = np.flatnonzero(stats[1:, cv2.CC_STAT_AREA] > self.config.OBSTACLE_AREA_THRESHOLD * scale * scale) + 1
+            return (indices, np.ascontiguousarray(stats[indices, :4] / scale, dtype=np.int32))
         except Exception as e:
             print(f"Error detecting obstacle: {e}")
             traceback.print_exc()
+            return (np.empty(0, dtype=np.intp), np.empty((0, 4), dtype=np.int32))
+
+    def _obstacles_from_rects(self, frame_shape, indices, rects, pool=None):
+        """
+        World half of obstacle detection: place the bounding boxes around the robot's current pose.
+
+        Args:
+            frame_shape: Shape of the frame the boxes were found in.
+            indices, rects: Blob labels and bounding boxes from _find_obstacle_rects.
+            pool: Optional _RecordPool to take the dictionaries from, the caller then releases them.
+
+        Returns:
+            list: A list of obstacle information dictionaries, each containing 'id', 'position', and 'size'.
+        """
+        obstacles_found = []
+        if len(rects) == 0:
+            return obstacles_found
+        
+        # One timestamp for every obstacle id generated from this frame
+        frame_timestamp = int(time.time())
         
+        # Convert every obstacle from image coordinates to world coordinates in one call (simplified)
+        # In a real system, you would use proper coordinate transformation
+        robot_x, robot_y = self.robot.get_position()
+        world_x, world_y, distance, world_angle = _rects_to_world(
+            rects, frame_shape[1], frame_shape[0],
+            float(robot_x), float(robot_y), float(self.robot.get_orientation()))
+        
+        for idx, (x, y, w, h), obstacle_x, obstacle_y, obstacle_distance, obstacle_angle in zip(
+                indices.tolist(), rects.tolist(), world_x.tolist(), world_y.tolist(), distance.tolist(), world_angle.tolist()):
+            obstacle = {} if pool is None else pool.acquire()
+            obstacle['id'] = f'obstacle_{frame_timestamp}_{idx}'
+            obstacle['position'] = (obstacle_x, obstacle_y)
+            obstacle['size'] = (w, h)
+            obstacle['distance'] = obstacle_distance
+            obstacle['angle'] = obstacle_angle
+            obstacles_found.append(obstacle)
         return obstacles_found
 
+    def _record_obstacles(self, obstacles):
+        """
+        Store newly seen obstacles in the map, skipping ones that fall in a grid cell already holding an obstacle.
+
+        Args:
+            obstacles: Obstacle dictionaries from detect_obstacle.
+        """
+        cell_size = self.config.OBSTACLE_MERGE_DISTANCE
+        timestamp = time.monotonic_ns()
+        for obs in obstacles:
+            cell = (int(obs['position'][0] // cell_size), int(obs['position'][1] // cell_size))
+            if cell in self.known_obstacle_cells:
+                continue
+            self.known_obstacle_cells.add(cell)
+            # Store obstacle information in map storage
+            self.map_store.add_obstacle(obs, timestamp)
+
     def avoid_obstacle(self, obstacles):
         """
         Execute an obstacle avoidance strategy based on the detected obstacles.
@@ -505,9 +772,13 @@ class SecuritySystem:
         # Start rotating
         self.robot.turn_right(self.config.SCAN_ROTATION_SPEED)
 
-    def continue_scan(self):
+    def continue_scan(self, frame, obstacle_rects=None):
         """
         Continue the current scan, checking if we've completed a full rotation.
+
+        Args:
+            frame: The latest frame delivered by the capture thread.
+            obstacle_rects: The capture thread's _find_obstacle_rects result for frame, computed here when missing.
         """
         if not self.scan_in_progress:
             return
@@ -516,20 +787,23 @@ class SecuritySystem:
         # Calculate how far we've rotated since starting the scan
         self.current_scan_angle = (current_orientation - self.scan_start_orientation + 360) % 360
         
-        # Capture frame and detect obstacles
-        frame = self.blacklist.get_current_frame()
+        # Detect obstacles in the captured frame
         if frame is not None:
-            obstacles = self.detect_obstacle(frame)
-            for obs in obstacles:
-                # Store obstacle information in map storage
-                self.map_store.add_obstacle(obs)
-            
-            # If obstacles are detected and they're close, avoid them
-            close_obstacles = [obs for obs in obstacles if obs['distance'] < self.config.SAFE_DISTANCE]
-            if close_obstacles:
-                self.robot.stop_everything()
-                self.avoid_obstacle(close_obstacles)
-                return  # Early return as we're now in avoidance mode
+            if obstacle_rects is None:
+                obstacle_rects = self._find_obstacle_rects(frame)
+            obstacles = self._obstacles_from_rects(frame.shape, *obstacle_rects, pool=self.obstacle_pool)
+            try:
+                # The map copies what it keeps, so the dictionaries can go back to the pool afterwards
+                self._record_obstacles(obstacles)
+                
+                # If obstacles are detected and they're close, avoid them
+                close_obstacles = [obs for obs in obstacles if obs['distance'] < self.config.SAFE_DISTANCE]
+                if close_obstacles:
+                    self.robot.stop_everything()
+                    self.avoid_obstacle(close_obstacles)
+                    return  # Early return as we're now in avoidance mode
+            finally:
+                self.obstacle_pool.release(obstacles)
         
         # Update robot position in map
         self._update_robot_position_in_map()
@@ -546,6 +820,9 @@ class SecuritySystem:
         Clean up system resources, including robot and camera.
         """
         print("Cleaning up system resources...")
+        self.stop_event.set()
+        if self.capture_thread.is_alive():
+            self.capture_thread.join()
         try:
             if self.robot:
                 self.robot.stop_everything()
@@ -566,13 +843,15 @@ class SecuritySystem:
         while recording map data.
         """
         print("Security system starting...")
+        self._pin_current_thread(self.control_cores)
+        self.capture_thread.start()
         try:
             while self.is_running:
-                current_time = time.time()
-                if current_time - self.last_scan_time < self.config.SCAN_INTERVAL:
-                    time.sleep(0.05)  # Increased sleep time to reduce CPU usage
-                    continue
-                self.last_scan_time = current_time
+                # Sleep exactly until the next scan is due instead of polling
+                remaining = self.last_scan_time + self.config.SCAN_INTERVAL - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
+                self.last_scan_time = time.monotonic()
 
                 try:
                     # First, check if we're outside the patrol area
@@ -580,20 +859,32 @@ class SecuritySystem:
                         self._return_to_safe_zone()
                         continue
                         
-                    # Check if any blacklisted faces are detected in view
-                    blacklisted_faces = self.blacklist.getBlackListedFacesInView()
-                    if blacklisted_faces:
-                        # Process the first detected face
-                        print(f"Target detected: {blacklisted_faces[0].get('name', 'Unknown')}")
-                        processed = self.process_target(blacklisted_faces[0])
-                        if not processed:
-                            print("Target not yet processed, continuing to track...")
-                    elif self.state == "SCANNING" and self.scan_in_progress:
-                        # Continue an in-progress scan
-                        self.continue_scan()
-                    elif self.state != "AVOIDING":  # Don't start a new scan if we're avoiding obstacles
-                        # If no face target is detected and we're not scanning, start a new scan
-                        self.start_new_scan()
+                    # Take the latest frame, blacklisted faces and obstacle boxes from the capture thread
+                    try:
+                        frame, blacklisted_faces, obstacle_rects = self.detection_queue.get(timeout=1)
+                    except queue.Empty:
+                        continue
+                    # A face hit whose own entry was dropped for a newer frame is still acted on
+                    pending_faces = self._take_pending_faces()
+                    if not blacklisted_faces:
+                        blacklisted_faces = pending_faces
+
+                    try:
+                        if blacklisted_faces:
+                            # Process the first detected face
+                            print(f"Target detected: {blacklisted_faces[0].get('name', 'Unknown')}")
+                            processed = self.process_target(blacklisted_faces[0])
+                            if not processed:
+                                print("Target not yet processed, continuing to track...")
+                        elif self.state == "SCANNING" and self.scan_in_progress:
+                            # Continue an in-progress scan
+                            self.continue_scan(frame, obstacle_rects)
+                        elif self.state != "AVOIDING":  # Don't start a new scan if we're avoiding obstacles
+                            # If no face target is detected and we're not scanning, start a new scan
+                            self.start_new_scan()
+                    finally:
+                        # Nothing keeps the frame past this point, its buffer can be filled again
+                        self.blacklist.release_frame(frame)
                         
                     # Update the robot's position in the map
                     self._update_robot_position_in_map()
@@ -613,7 +904,7 @@ class SecuritySystem:
             print("Map data for this patrol mission:")
             print(map_data)
             print("Map data explanation:")
-            print("- 'robot_path': List of robot positions and orientations over time")
+            print("- 'robot_path': Arrays of robot timestamps, positions and orientations over time")
             print("- 'obstacles': List of detected obstacles with positions and sizes")
             print("- Use this data for post-mission analysis or to improve patrol routes")
 
@@ -9,19 +9,37 @@
 #define RIGHT_DIRECTION_PIN 26
 #define RIGHT_ENABLE_PIN 27
 
+#define LEFT_PWM_CHANNEL 0
+#define RIGHT_PWM_CHANNEL 1
+
+#define SET_SPEED 0x03
+
+//The host resends the current speed well within this, if it goes quiet (crash, reboot, unplugged USB) both motors stop
+#define SPEED_TIMEOUT_MS 500
+
 struct command {
     uint8_t command;
     uint8_t parameter;
     uint8_t newline;
 };
 
+//Speeds in signed big endian pulses per second for both motors, 0 stops a motor
+struct speed_command {
+    uint8_t command;
+    uint8_t left_high;
+    uint8_t left_low;
+    uint8_t right_high;
+    uint8_t right_low;
+    uint8_t newline;
+};
+
 void read_command(struct command * cmd) {
     Serial.readBytes((char *)cmd, 3);
     return;
 }
 
-void stop_everything(struct command * cmd) {
-    //Does nothing right now
+void read_speed_command(struct speed_command * cmd) {
+    Serial.readBytes((char *)cmd, 6);
     return;
 }
 
@@ -31,49 +49,43 @@ void toggle_nerf_gun(struct command * cmd) {
 }
 
 //USE RISING EDGE MODE FOR THE MOTORS, PLEASE CONFIGURE THIS CORRECTLY
-void pulse_motor(struct command * cmd) {
-    switch (cmd->parameter) {
-        case 0x00:
-            //Set Forward Direction
-            digitalWrite(LEFT_DIRECTION_PIN, HIGH);
-            delayMicroseconds(5);
-            //Pulse
-            digitalWrite(LEFT_PULSE_PIN, LOW);
-            delayMicroseconds(3);
-            digitalWrite(LEFT_PULSE_PIN, HIGH); 
+//The pulse pins are driven by the LEDC peripheral, one rising edge per step, the host sends speed changes plus a periodic resend
+//Rates currently being generated, reprogramming a channel with its own rate would restart its period
+int16_t left_rate = 0;
+int16_t right_rate = 0;
+//millis() when the last SET_SPEED frame arrived
+unsigned long last_speed_ms = 0;
+
+void set_motor_speed(uint8_t channel, uint8_t direction_pin, int16_t * current_rate, int16_t rate) {
+    if (rate == *current_rate) {
+        return;
+    }
+    *current_rate = rate;
 
-        break;
-        case 0x01:
-            //Set Backward Direction
-            digitalWrite(LEFT_DIRECTION_PIN, LOW);
-            delayMicroseconds(5);
-            //Pulse
-            digitalWrite(LEFT_PULSE_PIN, LOW);
-            delayMicroseconds(3);
-            digitalWrite(LEFT_PULSE_PIN, HIGH); 
+    if (rate == 0) {
+        ledcWriteTone(channel, 0);
+        return;
+    }
 
-        break;
-        case 0x02:
-            //Set Forward Direction
-            digitalWrite(RIGHT_DIRECTION_PIN, HIGH);
-            delayMicroseconds(5);
-            //Pulse
-            digitalWrite(RIGHT_PULSE_PIN, LOW);
-            delayMicroseconds(3);
-            digitalWrite(RIGHT_PULSE_PIN, HIGH); 
+    //Set Direction, positive is forward
+    digitalWrite(direction_pin, rate > 0 ? HIGH : LOW);
+    delayMicroseconds(5);
+    ledcWriteTone(channel, abs(rate));
+}
 
-        break;
-        case 0x03:
-            //Set Backward Direction
-            digitalWrite(RIGHT_DIRECTION_PIN, LOW);
-            delayMicroseconds(5);
-            //Pulse
-            digitalWrite(RIGHT_PULSE_PIN, LOW);
-            delayMicroseconds(3);
-            digitalWrite(RIGHT_PULSE_PIN, HIGH); 
+void stop_motors() {
+    set_motor_speed(LEFT_PWM_CHANNEL, LEFT_DIRECTION_PIN, &left_rate, 0);
+    set_motor_speed(RIGHT_PWM_CHANNEL, RIGHT_DIRECTION_PIN, &right_rate, 0);
+}
 
-        break;
-    }
+void stop_everything(struct command * cmd) {
+    stop_motors();
+}
+
+void set_speed(struct speed_command * cmd) {
+    last_speed_ms = millis();
+    set_motor_speed(LEFT_PWM_CHANNEL, LEFT_DIRECTION_PIN, &left_rate, (int16_t)((cmd->left_high << 8) | cmd->left_low));
+    set_motor_speed(RIGHT_PWM_CHANNEL, RIGHT_DIRECTION_PIN, &right_rate, (int16_t)((cmd->right_high << 8) | cmd->right_low));
 }
 
 void exec_command(struct command * cmd) {
@@ -84,9 +96,6 @@ void exec_command(struct command * cmd) {
         case 0x01:
             toggle_nerf_gun(cmd); 
         break;
-        case 0x02:
-            pulse_motor(cmd);
-        break;
     }
 }
 
@@ -98,10 +107,12 @@ void setup()
     digitalWrite(LEFT_ENABLE_PIN, LOW);
     digitalWrite(RIGHT_ENABLE_PIN, LOW);
 
-    pinMode(LEFT_PULSE_PIN, OUTPUT);
-    pinMode(RIGHT_PULSE_PIN, OUTPUT);
-    digitalWrite(LEFT_PULSE_PIN, HIGH);
-    digitalWrite(RIGHT_PULSE_PIN, HIGH);
+    ledcSetup(LEFT_PWM_CHANNEL, 1000, 8);
+    ledcSetup(RIGHT_PWM_CHANNEL, 1000, 8);
+    ledcAttachPin(LEFT_PULSE_PIN, LEFT_PWM_CHANNEL);
+    ledcAttachPin(RIGHT_PULSE_PIN, RIGHT_PWM_CHANNEL);
+    ledcWriteTone(LEFT_PWM_CHANNEL, 0);
+    ledcWriteTone(RIGHT_PWM_CHANNEL, 0);
 
     pinMode(LEFT_DIRECTION_PIN, OUTPUT);
     pinMode(RIGHT_DIRECTION_PIN, OUTPUT);
@@ -112,11 +123,21 @@ void setup()
 void loop()
 {
     struct command cmd;
+    struct speed_command speed_cmd;
     
     while(1) {
-       if (Serial.available() >= 3) {
+       if (Serial.available() > 0 && Serial.peek() == SET_SPEED) {
+            if (Serial.available() >= 6) {
+                read_speed_command(&speed_cmd);
+                set_speed(&speed_cmd);
+            }
+       } else if (Serial.available() >= 3) {
             read_command(&cmd);
             exec_command(&cmd);       
        }
+
+       if ((left_rate != 0 || right_rate != 0) && millis() - last_speed_ms > SPEED_TIMEOUT_MS) {
+            stop_motors();
+       }
     }
 }
@@ -6,98 +6,235 @@ This data will be cleared when the system shuts down.
 """
 
 import time
+from collections import defaultdict, OrderedDict
+from dataclasses import dataclass, field, replace
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+@dataclass(slots=True)
+class Obstacle:
+    """
+    A stored obstacle, position and size are in world units.
+    Any other keys the obstacle was added with (e.g. the detector's 'distance' and 'angle') are kept in extra.
+    """
+    id: str
+    position: tuple
+    size: tuple
+    timestamp: int = 0
+    extra: dict = field(default_factory=dict)
+
+@dataclass(slots=True)
+class Feature:
+    """
+    A stored terrain feature, e.g. a wall.
+    Any other keys the feature was added with are kept in extra.
+    """
+    id: str
+    position: tuple
+    description: str = None
+    timestamp: int = 0
+    extra: dict = field(default_factory=dict)
+
+def _extra_keys(record, record_type):
+    """
+    Copy of the keys in a dict that record_type has no field for.
+    """
+    return {key: value for key, value in record.items() if key not in record_type.__dataclass_fields__}
+
+# Below this many obstacles the grid is cheaper than building and querying a KD-tree
+KDTREE_MIN_OBSTACLES = 64
+# Obstacles appended since the last KD-tree build that are tolerated before it is rebuilt
+KDTREE_REBUILD_EVERY = 64
+# Distinct (position, radius) queries whose results are kept until the obstacles change
+NEARBY_CACHE_SIZE = 32
 
 class MapStore:
-    def __init__(self):
-        # Store obstacle information; each obstacle is a dictionary, e.g.,
-        # {'id': 'obs1', 'position': (x, y), 'size': (width, height)}
+    def __init__(self, cell_size=50, max_path_length=10_000):
+        # Store obstacle information; each obstacle is an Obstacle record, e.g.,
+        # Obstacle(id='obs1', position=(x, y), size=(width, height))
         self.obstacles = []
         
-        # Store other terrain features with a similar dictionary format
+        # Store other terrain features as Feature records
         self.features = []
         
-        # Store robot position history as a list of tuples (timestamp, position, orientation)
-        self.robot_path = []
+        # Position of each obstacle/feature in the lists above, keyed by id
+        self._obstacle_idx = {}
+        self._feature_idx = {}
+        
+        # Uniform grid over obstacle positions: cell -> obstacle list indices, plus each obstacle's current cell.
+        # Cells should be about as large as a typical get_nearby_obstacles radius.
+        self._cell_size = cell_size
+        self._grid = defaultdict(list)
+        self._obstacle_cells = []
+        
+        # Obstacle positions as one contiguous array, row i matches self.obstacles[i]; grown by doubling
+        self._positions = np.empty((16, 2), dtype=np.float64)
+        
+        # With scipy available, large maps are searched through a KD-tree over the first _kdtree_size positions.
+        # Obstacles appended since are checked directly, and the tree is rebuilt once enough of them pile up
+        # or when an obstacle already in it moves.
+        self._kdtree = None
+        self._kdtree_size = 0
+        
+        # Recent get_nearby_obstacles results keyed by (x, y, radius), least recently used first.
+        # Every obstacle change bumps the epoch, entries from an older epoch are stale.
+        self._nearby_cache = OrderedDict()
+        self._cache_epoch = 0
+        
+        # Robot position history as parallel arrays (monotonic ns timestamp, x/y, orientation), grown by doubling.
+        # Once max_path_length samples are stored it becomes a ring: the newest sample overwrites the oldest,
+        # which sits at _path_start.
+        self._max_path_length = max_path_length
+        self._path_t = np.empty(min(1024, max_path_length), dtype=np.int64)
+        self._path_xy = np.empty((len(self._path_t), 2), dtype=np.float32)
+        self._path_theta = np.empty(len(self._path_t), dtype=np.float32)
+        self._path_start = 0
+        self._path_len = 0
         
         # Current robot position and orientation
         self.robot_position = None
         self.robot_orientation = None
     
-    def add_obstacle(self, obstacle):
+    def add_obstacle(self, obstacle, timestamp=None):
         """
         Add an obstacle's information.
         Args:
-            obstacle (dict): The obstacle information, which must include keys like 'id', 'position', and 'size'.
+            obstacle (Obstacle or dict): The obstacle information, a dict must include keys like 'id', 'position', and 'size'.
+            timestamp (int, optional): time.monotonic_ns() of the observation, pass one value for a whole batch.
         """
-        # Check if obstacle contains the required keys
-        required_keys = ['id', 'position', 'size']
-        if not all(key in obstacle for key in required_keys):
-            print(f"Warning: Obstacle missing required keys. Required: {required_keys}, Got: {list(obstacle.keys())}")
-            return
+        if timestamp is None:
+            timestamp = time.monotonic_ns()
+        
+        if isinstance(obstacle, dict):
+            # Check if obstacle contains the required keys
+            required_keys = ['id', 'position', 'size']
+            if not all(key in obstacle for key in required_keys):
+                print(f"Warning: Obstacle missing required keys. Required: {required_keys}, Got: {list(obstacle.keys())}")
+                return
             
-        # Add the obstacle with a timestamp
-        obstacle_with_timestamp = obstacle.copy()
-        obstacle_with_timestamp['timestamp'] = time.time()
+            # Store the obstacle with a timestamp
+            obstacle = Obstacle(obstacle['id'], obstacle['position'], obstacle['size'], timestamp, _extra_keys(obstacle, Obstacle))
+        else:
+            obstacle = replace(obstacle, timestamp=timestamp)
+        
+        self._cache_epoch += 1
         
         # Check if we already have an obstacle with the same ID
-        for i, existing in enumerate(self.obstacles):
-            if existing['id'] == obstacle['id']:
-                # Update existing obstacle instead of adding a new one
-                self.obstacles[i] = obstacle_with_timestamp
-                return
+        cell = self._cell_of(obstacle.position)
+        idx = self._obstacle_idx.get(obstacle.id)
+        if idx is not None:
+            # Update existing obstacle instead of adding a new one
+            self.obstacles[idx] = obstacle
+            if idx < self._kdtree_size and tuple(self._positions[idx]) != tuple(obstacle.position):
+                self._kdtree = None
+                self._kdtree_size = 0
+            self._positions[idx] = obstacle.position
+            old_cell = self._obstacle_cells[idx]
+            if old_cell != cell:
+                self._grid[old_cell].remove(idx)
+                self._grid[cell].append(idx)
+                self._obstacle_cells[idx] = cell
+            return
                 
-        self.obstacles.append(obstacle_with_timestamp)
+        idx = len(self.obstacles)
+        if idx == len(self._positions):
+            grown = np.empty((2 * idx, 2), dtype=np.float64)
+            grown[:idx] = self._positions
+            self._positions = grown
+        self._positions[idx] = obstacle.position
+        self._obstacle_idx[obstacle.id] = idx
+        self.obstacles.append(obstacle)
+        self._grid[cell].append(idx)
+        self._obstacle_cells.append(cell)
     
-    def add_feature(self, feature):
+    def _cell_of(self, position):
+        """
+        Return the grid cell containing a position.
+        """
+        return (int(position[0] // self._cell_size), int(position[1] // self._cell_size))
+    
+    def add_feature(self, feature, timestamp=None):
         """
         Add terrain feature information.
         Args:
-            feature (dict): For example, {'id': 'wall1', 'position': (x, y), 'description': 'wall'}.
+            feature (Feature or dict): For example, {'id': 'wall1', 'position': (x, y), 'description': 'wall'}.
+            timestamp (int, optional): time.monotonic_ns() of the observation, pass one value for a whole batch.
         """
-        # Check if feature contains the required keys
-        required_keys = ['id', 'position']
-        if not all(key in feature for key in required_keys):
-            print(f"Warning: Feature missing required keys. Required: {required_keys}, Got: {list(feature.keys())}")
-            return
+        if timestamp is None:
+            timestamp = time.monotonic_ns()
+        
+        if isinstance(feature, dict):
+            # Check if feature contains the required keys
+            required_keys = ['id', 'position']
+            if not all(key in feature for key in required_keys):
+                print(f"Warning: Feature missing required keys. Required: {required_keys}, Got: {list(feature.keys())}")
+                return
             
-        # Add the feature with a timestamp
-        feature_with_timestamp = feature.copy()
-        feature_with_timestamp['timestamp'] = time.time()
+            # Store the feature with a timestamp
+            feature = Feature(feature['id'], feature['position'], feature.get('description'), timestamp, _extra_keys(feature, Feature))
+        else:
+            feature = replace(feature, timestamp=timestamp)
         
         # Check if we already have a feature with the same ID
-        for i, existing in enumerate(self.features):
-            if existing['id'] == feature['id']:
-                # Update existing feature instead of adding a new one
-                self.features[i] = feature_with_timestamp
-                return
+        idx = self._feature_idx.get(feature.id)
+        if idx is not None:
+            # Update existing feature instead of adding a new one
+            self.features[idx] = feature
+            return
                 
-        self.features.append(feature_with_timestamp)
+        self._feature_idx[feature.id] = len(self.features)
+        self.features.append(feature)
     
-    def update_robot_position(self, position, orientation):
+    def update_robot_position(self, position, orientation, timestamp=None):
         """
         Update the current robot position and orientation, and add it to the robot path history.
         
         Args:
             position (tuple): The (x, y) coordinates of the robot.
             orientation (float): The orientation angle in degrees.
+            timestamp (int, optional): time.monotonic_ns() of the update, taken here if not given.
         """
         # Update current position and orientation
         self.robot_position = position
         self.robot_orientation = orientation
         
         # Add to path history with timestamp
-        timestamp = time.time()
-        self.robot_path.append({
-            'timestamp': timestamp,
-            'position': position,
-            'orientation': orientation
-        })
-        
-        # Optionally, limit the path history to prevent excessive memory usage
-        # Uncomment the following code if needed:
-        # max_path_length = 1000  # Adjust based on your needs
-        # if len(self.robot_path) > max_path_length:
-        #     self.robot_path = self.robot_path[-max_path_length:]
+        capacity = len(self._path_t)
+        if self._path_len < capacity:
+            i = self._path_len
+            self._path_len += 1
+        elif capacity < self._max_path_length:
+            capacity = min(capacity * 2, self._max_path_length)
+            self._path_t = np.resize(self._path_t, capacity)
+            self._path_xy = np.resize(self._path_xy, (capacity, 2))
+            self._path_theta = np.resize(self._path_theta, capacity)
+            i = self._path_len
+            self._path_len += 1
+        else:
+            i = self._path_start
+            self._path_start = (i + 1) % capacity
+        
+        self._path_t[i] = time.monotonic_ns() if timestamp is None else timestamp
+        self._path_xy[i] = position
+        self._path_theta[i] = orientation
+    
+    def get_robot_path(self):
+        """
+        Return the robot path history, oldest sample first.
+        
+        Returns:
+            tuple: (timestamps, positions, orientations) arrays of shape (N,), (N, 2) and (N,).
+                   These are views into the store until the path wraps around, after which they are copies.
+        """
+        n, start = self._path_len, self._path_start
+        if start == 0:
+            return self._path_t[:n], self._path_xy[:n], self._path_theta[:n]
+        
+        return tuple(np.concatenate((column[start:], column[:start])) for column in (self._path_t, self._path_xy, self._path_theta))
     
     def get_map_data(self):
         """
@@ -106,7 +243,7 @@ class MapStore:
         return {
             'obstacles': self.obstacles,
             'features': self.features,
-            'robot_path': self.robot_path,
+            'robot_path': dict(zip(('timestamp', 'position', 'orientation'), self.get_robot_path())),
             'current_position': self.robot_position,
             'current_orientation': self.robot_orientation
         }
@@ -120,21 +257,82 @@ class MapStore:
             radius (float): The radius within which to find obstacles.
             
         Returns:
-            list: A list of obstacles within the specified radius.
-        """
-        nearby = []
-        for obstacle in self.obstacles:
-            # Calculate distance from position to obstacle
-            obs_pos = obstacle['position']
-            distance = ((position[0] - obs_pos[0])**2 + (position[1] - obs_pos[1])**2)**0.5
-            if distance <= radius:
-                # Add distance information to the obstacle
-                obs_with_distance = obstacle.copy()
-                obs_with_distance['distance_from_point'] = distance
-                nearby.append(obs_with_distance)
-        
-        # Sort by distance
-        return sorted(nearby, key=lambda x: x['distance_from_point'])
+            list: (distance, obstacle) tuples for the obstacles within the specified radius, closest first.
+                  The obstacles are the stored Obstacle records themselves, not copies.
+        """
+        key = (position[0], position[1], radius)
+        cached = self._nearby_cache.get(key)
+        if cached is not None and cached[0] == self._cache_epoch:
+            self._nearby_cache.move_to_end(key)
+            return list(cached[1])
+        
+        nearby = self._find_nearby_obstacles(position, radius)
+        self._nearby_cache[key] = (self._cache_epoch, nearby)
+        self._nearby_cache.move_to_end(key)
+        if len(self._nearby_cache) > NEARBY_CACHE_SIZE:
+            self._nearby_cache.popitem(last=False)
+        return list(nearby)
+    
+    def _find_nearby_obstacles(self, position, radius):
+        """
+        Uncached body of get_nearby_obstacles.
+        """
+        radius_sq = radius * radius
+        if cKDTree is not None and len(self.obstacles) >= KDTREE_MIN_OBSTACLES:
+            candidates = self._kdtree_candidates(position, radius)
+        else:
+            candidates = self._grid_candidates(position, radius)
+        if not candidates:
+            return []
+        
+        # Squared distances for every candidate at once, square roots only for the ones in range.
+        # Candidates are in insertion order and the sort is stable, so ties keep that order.
+        candidates = np.array(candidates, dtype=np.intp)
+        candidates.sort()
+        deltas = self._positions[candidates] - position
+        distance_sq = deltas[:, 0] * deltas[:, 0] + deltas[:, 1] * deltas[:, 1]
+        in_range = distance_sq <= radius_sq
+        hits = candidates[in_range]
+        hit_distance_sq = distance_sq[in_range]
+        order = np.argsort(hit_distance_sq, kind='stable')
+        
+        obstacles = self.obstacles
+        return [(distance, obstacles[idx]) for idx, distance in zip(hits[order].tolist(), np.sqrt(hit_distance_sq[order]).tolist())]
+    
+    def _kdtree_candidates(self, position, radius):
+        """
+        Indices of the obstacles that may be within radius of position, from the KD-tree plus the ones added since it was built.
+        """
+        count = len(self.obstacles)
+        if self._kdtree is None or count - self._kdtree_size > KDTREE_REBUILD_EVERY:
+            self._kdtree = cKDTree(self._positions[:count])
+            self._kdtree_size = count
+        
+        candidates = self._kdtree.query_ball_point(position, radius)
+        candidates.extend(range(self._kdtree_size, count))
+        return candidates
+    
+    def _grid_candidates(self, position, radius):
+        """
+        Indices of the obstacles that may be within radius of position, from the grid cells the search circle overlaps.
+        """
+        # Only obstacles in the cells overlapping the search circle's bounding box can be in range
+        min_cx, min_cy = self._cell_of((position[0] - radius, position[1] - radius))
+        max_cx, max_cy = self._cell_of((position[0] + radius, position[1] + radius))
+        grid = self._grid
+        if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > len(grid):
+            # The radius spans more cells than are occupied, walking the occupied cells is cheaper
+            candidates = [idx
+                          for (cx, cy), indices in grid.items()
+                          if min_cx <= cx <= max_cx and min_cy <= cy <= max_cy
+                          for idx in indices]
+        else:
+            candidates = [idx
+                          for cx in range(min_cx, max_cx + 1)
+                          for cy in range(min_cy, max_cy + 1)
+                          if (cx, cy) in grid
+                          for idx in grid[(cx, cy)]]
+        return candidates
     
     def clear(self):
         """
@@ -142,6 +340,15 @@ class MapStore:
         """
         self.obstacles.clear()
         self.features.clear()
-        self.robot_path.clear()
+        self._obstacle_idx.clear()
+        self._feature_idx.clear()
+        self._grid.clear()
+        self._obstacle_cells.clear()
+        self._kdtree = None
+        self._kdtree_size = 0
+        self._nearby_cache.clear()
+        self._cache_epoch += 1
+        self._path_start = 0
+        self._path_len = 0
         self.robot_position = None
         self.robot_orientation = None
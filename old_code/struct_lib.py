@@ -1,100 +1,88 @@
 import struct
 import serial
 import threading
-import time
 
-usleep = lambda x: time.sleep(x/1000000.0)
+_COMMAND_FRAME = struct.Struct('>BBB')
+_SPEED_FRAME = struct.Struct('>BhhB')
+
+# Every fixed command the robot sends, packed once
+_STOP_PACKET = _COMMAND_FRAME.pack(0, 0, ord('\n'))
+_NERF_OFF_PACKET = _COMMAND_FRAME.pack(1, 0, ord('\n'))
+_NERF_ON_PACKET = _COMMAND_FRAME.pack(1, 1, ord('\n'))
+_PACKETS = {(0, 0): _STOP_PACKET, (1, 0): _NERF_OFF_PACKET, (1, 1): _NERF_ON_PACKET}
 
 class SpeedController:
+    # The ESP32 generates the step pulses in hardware. Changes are sent right away, and a keepalive thread resends
+    # a non-zero speed every RESEND_SECONDS since the firmware stops both motors after 500 ms without a speed frame.
+    # Frame: 0x03, signed big endian left then right pulses per second (negative is backward), newline
+    SET_SPEED = 0x03
+    MAX_PULSES_PER_SECOND = 32767
+    RESEND_SECONDS = 0.2
+
     def __init__(self, ser, serlock, pulse_Per_Rev=800, mm_Per_Rev=43.018):
-        self.pulse_Left_Us = 0
-        self.pulse_Right_Us = 0
-        self.right_Forward = True
-        self.left_Forward = True
-        self.disable_Left = True
-        self.disable_Right = True
-        self.state_Lock = threading.Lock()
-        self.exit = False
         self.ser = ser
         self.serlock = serlock
         
         self.pulse_Per_Rev = pulse_Per_Rev
         self.mm_Per_Rev = mm_Per_Rev
+        self.pulses_Per_Mm = pulse_Per_Rev / mm_Per_Rev
+        
+        # Last rates sent, both sides go out together so changing one resends the other
+        self.left_Pulses = 0
+        self.right_Pulses = 0
+        self.sent = False
+        
+        self.exit_Event = threading.Event()
+        self.keepalive_Thread = threading.Thread(target=self.keepalive_Loop, daemon=True)
+        self.keepalive_Thread.start()
+    
+    def write_Pulses(self, left, right):
+        message = _SPEED_FRAME.pack(self.SET_SPEED, left, right, ord('\n'))
+        self.serlock.acquire()
+        self.ser.write(message)
+        self.left_Pulses, self.right_Pulses, self.sent = left, right, True
+        self.serlock.release()
+    
+    def forget_Pulses(self):
+        # The firmware stopped both motors some other way (the stop command), so there is nothing left to resend.
+        # Call with serlock held, together with the write that stops them
+        self.left_Pulses, self.right_Pulses, self.sent = 0, 0, True
     
-    def left_Loop(self, s_Lock, serlock, ser):
-        while True:
-            s_Lock.acquire()
-            if self.exit == True:
-                s_Lock.release()
-                break
-            disable = self.disable_Left
-            sleep_Amount = self.pulse_Left_Us
-            forward = self.left_Forward
-            s_Lock.release()
-            usleep(abs(sleep_Amount))
-            if not disable:
-                serlock.acquire()
-                if forward:
-                    ser.write(struct.pack('>BBB', 0x02, 0x00, ord('\n')))
-                else:
-                    ser.write(struct.pack('>BBB', 0x02, 0x01, ord('\n')))
-                serlock.release()
-                
-            
-    def right_Loop(self, s_Lock, serlock, ser):
-        while True:
-            s_Lock.acquire()
-            if self.exit == True:
-                s_Lock.release()
-                break
-            disable = self.disable_Right
-            sleep_Amount = self.pulse_Right_Us
-            forward = self.right_Forward
-            s_Lock.release()
-            usleep(abs(sleep_Amount))
-            if not disable:
-                serlock.acquire()
-                if forward:
-                    ser.write(struct.pack('>BBB', 0x02, 0x02, ord('\n')))
-                else:
-                    ser.write(struct.pack('>BBB', 0x02, 0x03, ord('\n')))
-                serlock.release()
-            
-    
-    def start(self):
-        self.t1 = threading.Thread(target=self.left_Loop, args=(self.state_Lock, self.serlock, self.ser))
-        self.t2 = threading.Thread(target=self.right_Loop, args=(self.state_Lock, self.serlock, self.ser))
-        self.t1.start()
-        self.t2.start()
-    
-    def mms_To_Us_Per_Pulse(self, mms):
-        return (1000000)/(mms * (1/self.mm_Per_Rev)*self.pulse_Per_Rev)
+    def keepalive_Loop(self):
+        while not self.exit_Event.wait(self.RESEND_SECONDS):
+            # Check and resend under one hold of the lock, so a stop written in between is never followed by a stale speed
+            self.serlock.acquire()
+            left, right = self.left_Pulses, self.right_Pulses
+            if left != 0 or right != 0:
+                self.ser.write(_SPEED_FRAME.pack(self.SET_SPEED, left, right, ord('\n')))
+            self.serlock.release()
     
+    def mms_To_Pulses_Per_Second(self, mms):
+        pulses = round(mms * self.pulses_Per_Mm)
+        return max(-self.MAX_PULSES_PER_SECOND, min(self.MAX_PULSES_PER_SECOND, pulses))
+    
+    def send_Pulses(self, left, right):
+        if self.sent and left == self.left_Pulses and right == self.right_Pulses:
+            return
+        
+        self.write_Pulses(left, right)
+    
+    def set_Speeds(self, left_mms, right_mms):
+        self.send_Pulses(self.mms_To_Pulses_Per_Second(left_mms), self.mms_To_Pulses_Per_Second(right_mms))
     
     def set_Speed_Left(self,mms):
-        self.state_Lock.acquire()
-        if (mms == 0):
-            self.pulse_Left_Us = 1000
-            self.disable_Left = True
-        else:
-            self.pulse_Left_Us = self.mms_To_Us_Per_Pulse(mms)
-            self.disable_Left = False
-        self.state_Lock.release()
+        self.send_Pulses(self.mms_To_Pulses_Per_Second(mms), self.right_Pulses)
     
     def set_Speed_Right(self,mms):
-        self.state_Lock.acquire()
-        if (mms == 0):
-            self.pulse_Right_Us = 1000
-            self.disable_Right = True
-        else:
-            self.pulse_Right_Us = self.mms_To_Us_Per_Pulse(mms)
-            self.disable_Right = False
-        self.state_Lock.release()
+        self.send_Pulses(self.left_Pulses, self.mms_To_Pulses_Per_Second(mms))
     
     def stop(self):
-        self.state_Lock.acquire()
-        self.exit = True
-        self.state_Lock.release()
+        self.set_Speeds(0, 0)
+    
+    def close(self):
+        self.exit_Event.set()
+        self.keepalive_Thread.join()
+        self.stop()
         
     
     
@@ -111,23 +99,34 @@ class SecurityRobot:
         self.serlock = threading.Lock()
         self.ser = serial.Serial(serial_port, baud_rate, timeout=1)
         self.sc = SpeedController(self.ser, self.serlock)
-        self.sc.start()
 
     def send_command(self, command: int, units: int):
-        message = struct.pack('>BBB', command, units, ord('\n'))
+        if command == 0:
+            self.stop_everything()
+            return
+        message = _PACKETS.get((command, units))
+        if message is None:
+            message = _COMMAND_FRAME.pack(command, units, ord('\n'))
+        self.write_packet(message)
+    
+    def write_packet(self, message: bytes):
         self.serlock.acquire()
         self.ser.write(message)
         self.serlock.release()
     
     def stop_everything(self):
         """Sends the stop command to halt all operations."""
-        self.send_command(0, 0)
+        # The firmware zeroes both motors on this, the keepalive must not start them again
+        self.serlock.acquire()
+        self.sc.forget_Pulses()
+        self.ser.write(_STOP_PACKET)
+        self.serlock.release()
     
     def toggle_nerf_gun(self, state: bool):
         """Toggles the Nerf gun on or off.
         :param state: True to start shooting, False to stop shooting.
         """
-        self.send_command(1, 1 if state else 0)
+        self.write_packet(_NERF_ON_PACKET if state else _NERF_OFF_PACKET)
     
     def set_left_stepper(self, mms: int):
         self.sc.set_Speed_Left(mms)
@@ -136,9 +135,13 @@ class SecurityRobot:
 
         self.sc.set_Speed_Right(mms)
     
+    def set_steppers(self, left_mms: int, right_mms: int):
+        """Sets both stepper speeds with a single serial write."""
+        self.sc.set_Speeds(left_mms, right_mms)
+    
     def close(self):
         """Closes the serial connection."""
-        self.sc.stop()
+        self.sc.close()
         self.serlock.acquire()
         self.ser.close()
         self.serlock.release()
@@ -147,6 +150,5 @@ class SecurityRobot:
 # robot = SecurityRobot('/dev/ttyUSB0')
 # robot.stop_everything()
 # robot.toggle_nerf_gun(True)
-# robot.set_left_stepper(-1000)
-# robot.set_right_stepper(1500)
+# robot.set_steppers(-1000, 1500)
 # robot.close()
@@ -0,0 +1,104 @@
+import os
+import numpy as np
+import pytest
+
+ort = pytest.importorskip("onnxruntime")
+onnx = pytest.importorskip("onnx")
+pytest.importorskip("deepface")
+
+from onnx import helper, numpy_helper, TensorProto
+from BlackList import BlackList
+
+
+def _build_conv_model(path):
+    """Small stand-in for SFace: convolutions followed by a fully connected embedding layer."""
+    rng = np.random.default_rng(0)
+    initializers = [
+        numpy_helper.from_array(rng.standard_normal((8, 3, 3, 3)).astype(np.float32), "conv1_w"),
+        numpy_helper.from_array(rng.standard_normal((8, 8, 3, 3)).astype(np.float32), "conv2_w"),
+        numpy_helper.from_array(rng.standard_normal((8 * 12 * 12, 16)).astype(np.float32), "fc_w"),
+    ]
+    nodes = [
+        helper.make_node("Conv", ["input", "conv1_w"], ["conv1"]),
+        helper.make_node("Relu", ["conv1"], ["relu1"]),
+        helper.make_node("Conv", ["relu1", "conv2_w"], ["conv2"]),
+        helper.make_node("Flatten", ["conv2"], ["flat"]),
+        helper.make_node("MatMul", ["flat", "fc_w"], ["embedding"]),
+    ]
+    graph = helper.make_graph(
+        nodes,
+        "conv_embedding",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, [1, 3, 16, 16])],
+        [helper.make_tensor_value_info("embedding", TensorProto.FLOAT, [1, 16])],
+        initializers,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.save(model, path)
+
+
+def _cosine_similarities(a, b):
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def _face_like_batch(count, size):
+    """Smooth images in the 0-255 range the crops have, different enough from each other to give different embeddings."""
+    rng = np.random.default_rng(1)
+    ys, xs = np.mgrid[0:size[1], 0:size[0]].astype(np.float32)
+    batch = []
+    for _ in range(count):
+        cx, cy, spread = rng.uniform(0.3, 0.7) * size[0], rng.uniform(0.3, 0.7) * size[1], rng.uniform(10, 40)
+        blob = np.exp(-((xs - cx) ** 2 + (ys - cy) ** 2) / (2 * spread ** 2))
+        batch.append(np.stack([blob * rng.uniform(80, 255) for _ in range(3)]))
+    return np.stack(batch).astype(np.float32)
+
+
+def test_quantized_conv_model_builds_a_session(tmp_path):
+    weights_path = str(tmp_path / "model.onnx")
+    quantized_path = str(tmp_path / "model_uint8.onnx")
+    _build_conv_model(weights_path)
+
+    BlackList._quantizeWeights(weights_path, quantized_path)
+    session = BlackList._createSession(quantized_path)
+
+    output = session.run(None, {"input": np.ones((1, 3, 16, 16), dtype=np.float32)})[0]
+    assert output.shape == (1, 16)
+    assert np.isfinite(output).all()
+
+
+def test_fixed_batch_model_runs_a_larger_batch(tmp_path):
+    weights_path = str(tmp_path / "model.onnx")
+    _build_conv_model(weights_path)
+    session = BlackList._createSession(weights_path)
+    batch = _face_like_batch(3, (16, 16))
+
+    embeddings = BlackList._runSession(session, batch)
+
+    assert embeddings.shape == (3, 16)
+    for i in range(3):
+        single = session.run(None, {"input": batch[i:i + 1]})[0]
+        np.testing.assert_allclose(embeddings[i:i + 1], single, rtol=1e-5)
+
+
+def test_quantized_sface_matches_the_float_model(tmp_path):
+    from deepface.commons import folder_utils
+
+    weights_path = os.path.join(folder_utils.get_deepface_home(), ".deepface", "weights", BlackList._modelWeightsFile)
+    if not os.path.exists(weights_path):
+        pytest.skip("SFace weights not downloaded")
+
+    quantized_path = str(tmp_path / BlackList._quantizedWeightsFile)
+    BlackList._quantizeWeights(weights_path, quantized_path)
+    quantized = BlackList._createSession(quantized_path)
+    full = BlackList._createSession(weights_path)
+
+    batch = _face_like_batch(4, BlackList._modelInputSize)
+    quantized_embeddings = BlackList._runSession(quantized, batch)
+    full_embeddings = BlackList._runSession(full, batch)
+
+    assert quantized_embeddings.shape == full_embeddings.shape
+    assert quantized_embeddings.shape[0] == 4
+    # The same face through both models has to stay far inside the match threshold
+    assert _cosine_similarities(quantized_embeddings, full_embeddings).min() > 0.9
@@ -0,0 +1,64 @@
+import threading
+import time
+import pytest
+
+serial = pytest.importorskip("serial")
+
+import struct_lib
+
+
+class FakeSerial:
+    """Records every packet written, with the time it was written."""
+
+    def __init__(self, *args, **kwargs):
+        self.lock = threading.Lock()
+        self.writes = []
+
+    def write(self, message):
+        with self.lock:
+            self.writes.append((time.monotonic(), bytes(message)))
+
+    def close(self):
+        pass
+
+    def packets_after(self, moment):
+        with self.lock:
+            return [message for written, message in self.writes if written > moment]
+
+
+@pytest.fixture
+def robot(monkeypatch):
+    monkeypatch.setattr(struct_lib.serial, "Serial", FakeSerial)
+    robot = struct_lib.SecurityRobot("/dev/null")
+    yield robot
+    robot.close()
+
+
+def test_keepalive_resends_a_running_speed(robot):
+    robot.set_steppers(100, 100)
+    start = time.monotonic()
+    time.sleep(3 * struct_lib.SpeedController.RESEND_SECONDS)
+
+    speed_packets = [message for message in robot.ser.packets_after(start) if message[0] == struct_lib.SpeedController.SET_SPEED]
+    assert len(speed_packets) >= 2
+
+
+def test_stop_everything_is_not_undone_by_the_keepalive(robot):
+    robot.set_steppers(100, 100)
+    time.sleep(0.1)
+    robot.stop_everything()
+    stopped = time.monotonic()
+    time.sleep(3 * struct_lib.SpeedController.RESEND_SECONDS)
+
+    assert robot.ser.packets_after(stopped) == []
+    assert robot.ser.writes[-1][1] == struct_lib._STOP_PACKET
+
+
+def test_stop_command_through_send_command_is_not_undone(robot):
+    robot.set_steppers(100, -100)
+    time.sleep(0.1)
+    robot.send_command(0, 0)
+    stopped = time.monotonic()
+    time.sleep(3 * struct_lib.SpeedController.RESEND_SECONDS)
+
+    assert robot.ser.packets_after(stopped) == []